@@ -1,6 +1,9 @@
 import csv
 import os
 import sys
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import eolymp.universe
 import eolymp.judge
@@ -9,16 +12,31 @@ import eolymp.core
 import eolymp.universe
 import eolymp.judge
 
-client = eolymp.core.HttpClient(token=os.getenv("EOLYMP_TOKEN"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+import common.client
+
+parser = argparse.ArgumentParser(
+    description="Import contest results as ghost participants",
+    epilog="See more at https://github.com/eolymp/scripts/blob/main/basecamp/import-contest-results/README.md",
+)
+parser.add_argument('-j', '--jobs', type=int, default=8, help="Number of participants imported concurrently (default: 8)")
+common.client.add_arguments(parser)
+parser.add_argument('space_key', help="Space Key")
+parser.add_argument('contest_id', help="Contest ID")
+parser.add_argument('score_file', help="CSV file with results")
+
+args = parser.parse_args()
+
+if args.jobs < 1:
+    parser.error("--jobs must be at least 1")
+
+client = common.client.from_args(parser, args, args.jobs)
 universe = eolymp.universe.UniverseClient(client)
 
 
 def usage():
     print()
-    print("USAGE:")
-    print("  {} <space-key> <contest-id> <score-csv-file>".format(sys.argv[0]))
-    print()
-    print("See more at https://github.com/eolymp/scripts/blob/main/basecamp/import-contest-results/README.md")
+    parser.print_usage()
     print()
 
 
@@ -27,20 +45,78 @@ def validate_header(header):
         raise Exception("CSV file must contain column \"name\"")
 
 
-# open import file
-if len(sys.argv) < 4:
-    print("Some parameters are missing")
-    usage()
-    sys.exit(-1)
+# column plan compiled once from the header: positions of name and medal columns and score column for every problem
+def compile_plan(header):
+    validate_header(header)
+
+    position = {name: i for i, name in enumerate(header)}
+
+    problems = []
+    for index in problem_index_to_id:
+        column = "p" + str(index) + "_score"
+        if column in position:
+            problems.append((problem_index_to_id[index], position[column]))
+
+    return {
+        "header": header,
+        "name": position["name"],
+        "medal": position.get("medal"),
+        "problems": problems,
+    }
+
+
+# convert CSV rows into (name, [(problem ID, score)], medal) using the column plan
+def parse_results(reader, plan):
+    width = len(plan["header"])
+    name_column = plan["name"]
+    medal_column = plan["medal"]
+    problems = plan["problems"]
+
+    for row in reader:
+        if not row:
+            continue
+
+        if len(row) != width:
+            raise Exception("line {}: expected {} columns, found {}".format(reader.line_num, width, len(row)))
+
+        name = row[name_column]
+        if not name:
+            continue
+
+        breakdown = []
+        for problem_id, pos in problems:
+            try:
+                breakdown.append((problem_id, float(row[pos])))
+            except ValueError:
+                raise Exception("line {}, column \"{}\": invalid value \"{}\"".format(reader.line_num, plan["header"][pos], row[pos]))
+
+        yield name, breakdown, row[medal_column] if medal_column is not None else None
+
+
+# load all participants of the contest into a map indexed by name
+def get_participants_map():
+    mm = {}
+    offset = 0
+
+    while True:
+        out = judge.ListParticipants(eolymp.judge.ListParticipantsInput(contest_id=contest_id, offset=offset, size=100))
+        for item in out.items:
+            mm.setdefault(item.name, []).append(item)
+
+        offset += len(out.items)
+        if not out.items or offset >= out.total:
+            break
 
-space_key = sys.argv[1]
-contest_id = sys.argv[2]
-score_file = sys.argv[3]
+    return mm
+
+
+space_key = args.space_key
+contest_id = args.contest_id
+score_file = args.score_file
 
 # lookup space
 try:
-    out = universe.LookupSpace(eolymp.universe.LookupSpaceInput(key=space_key))
-    space = out.space
+    space = common.client.lookup_space(universe, space_key)
     print("Found space \"{}\"".format(space.name))
 except Exception as e:
     print("An error occurred while loading space with key \"{}\": {}".format(space_key, e))
@@ -53,12 +129,10 @@ judge = eolymp.judge.JudgeClient(client, space.url)
 problem_index_to_id = {}
 
 try:
-    out = judge.DescribeContest(eolymp.judge.DescribeContestInput(contest_id=contest_id))
-    contest = out.contest
+    contest = common.client.describe_contest(judge, contest_id)
     print("Found contest \"{}\"".format(contest.name))
 
-    out = judge.ListProblems(eolymp.judge.ListProblemsInput(contest_id=contest_id))
-    for item in out.items:
+    for item in common.client.list_problems(judge, contest_id):
         print("  - Found problem #{} with index \"{}\"".format(item.id, item.index))
         problem_index_to_id[item.index] = item.id
 except Exception as e:
@@ -75,88 +149,126 @@ except Exception as e:
     usage()
     sys.exit(-1)
 
-# validate header
-header = next(reader)
+# read results, the whole file is validated before anything is imported
 try:
-    validate_header(header)
+    results = list(parse_results(reader, compile_plan(next(reader, []))))
 except Exception as e:
     print("Score file \"{}\" has invalid format: {}".format(score_file, e))
     usage()
     sys.exit(-1)
 
+# rows are imported concurrently, so a name listed several times would get the result of whichever row finished last,
+# keep only the last row of every name
+results = list({name: (name, breakdown, medal) for name, breakdown, medal in results}.values())
 
-# read scores
-scores = []
 
-for row in reader:
-    data = dict(zip(header, row))
+# load participants
+try:
+    participants = get_participants_map()
+except Exception as e:
+    print("An error occurred while loading participants of contest with ID \"{}\": {}".format(contest_id, e))
+    sys.exit(-1)
 
-    name = data["name"]
+print("Found {} participants".format(sum(len(items) for items in participants.values())))
 
-    if not name:
-        continue
+lock = threading.Lock()
+failures = []
+imported = 0
 
-    expr = eolymp.wellknown.ExpressionString(value=name)
-    expr.__setattr__('is', eolymp.wellknown.ExpressionString.EQUAL)
+# match results with participants
+participant_ids = {}
+missing = []
 
-    out = judge.ListParticipants(eolymp.judge.ListParticipantsInput(
-        contest_id=contest_id,
-        filters=eolymp.judge.ListParticipantsInput.Filter(name=[expr]),
-    ))
+for name, _, _ in results:
+    items = participants.get(name, [])
 
-    participant_id = None
+    if len(items) > 1:
+        print("Multiple participants named {}, skipping...".format(name))
+    elif len(items) == 1 and not items[0].ghost:
+        print("Participant {} is not a ghost, skipping...".format(name))
+    elif len(items) == 1:
+        participant_ids[name] = items[0].id
+    elif name not in missing:
+        missing.append(name)
 
-    if len(out.items) == 0:
-        print("Participant {} does not exists, adding...".format(name))
 
+# add missing ghosts
+def assign_ghost(name):
+    try:
         out = judge.AssignParticipant(eolymp.judge.AssignParticipantInput(contest_id=contest_id, participant=eolymp.judge.Participant(
             name=name,
             ghost=True,
         )))
+    except Exception as e:
+        with lock:
+            failures.append((name, "an error occurred while adding participant: {}".format(e)))
+        return
 
-        participant_id = out.participant_id
+    with lock:
+        participant_ids[name] = out.participant_id
 
-    elif len(out.items) > 1:
-        print("Multiple participants named {}, skipping...".format(name))
-        continue
 
-    elif len(out.items) == 1:
-        if not out.items[0].ghost:
-            print("Participant {} is not a ghost, skipping...".format(name))
-            continue
+if missing:
+    print("Adding {} participants...".format(len(missing)))
 
-        participant_id = out.items[0].id
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        executor.map(assign_ghost, missing)
+
+
+# import score and medal
+MEDALS = {
+    "GOLD": eolymp.judge.GOLD_MEDAL, "Gold": eolymp.judge.GOLD_MEDAL,
+    "SILVER": eolymp.judge.SILVER_MEDAL, "Silver": eolymp.judge.SILVER_MEDAL,
+    "BRONZE": eolymp.judge.BRONZE_MEDAL, "Bronze": eolymp.judge.BRONZE_MEDAL,
+}
 
-    score = eolymp.judge.Score(valid_after=int(0), score=int(0))
-    for index in problem_index_to_id:
-        prefix = "p" + str(index)
-        if prefix + "_score" not in data:
-            continue
 
-        breakdown = eolymp.judge.Score.Problem(problem_id=problem_index_to_id[index], percentage=float(data[prefix + "_score"])/100, score=float(data[prefix + "_score"]))
-        score.breakdown.append(breakdown)
-        score.score += breakdown.score
+def import_result(name, breakdown, medal):
+    global imported
 
-    print("Import total score {} for {}...".format(score.score, participant_id))
+    participant_id = participant_ids[name]
+
+    score = eolymp.judge.Score(valid_after=int(0), score=int(0))
+    for problem_id, value in breakdown:
+        score.breakdown.append(eolymp.judge.Score.Problem(problem_id=problem_id, percentage=value/100, score=value))
+        score.score += value
 
     try:
         judge.ImportScore(eolymp.judge.ImportScoreInput(contest_id=contest_id, participant_id=participant_id, scores=[score]))
     except Exception as e:
-        print("An error occurred while importing score: {}".format(e))
-        sys.exit(-1)
-
-    if "medal" in data:
-        medal = eolymp.judge.NO_MEDAL
-        if data["medal"] == "GOLD" or  data["medal"] == "Gold":
-            medal = eolymp.judge.GOLD_MEDAL
-        if data["medal"] == "SILVER" or data["medal"] == "Silver":
-            medal = eolymp.judge.SILVER_MEDAL
-        if data["medal"] == "BRONZE" or data["medal"] == "Bronze":
-            medal = eolymp.judge.BRONZE_MEDAL
-
-        judge.UpdateParticipant(eolymp.judge.UpdateParticipantInput(
-            contest_id=contest_id,
-            participant_id=participant_id,
-            participant=eolymp.judge.Participant(medal=medal, name=name),
-            patch=[eolymp.judge.UpdateParticipantInput.MEDAL,eolymp.judge.UpdateParticipantInput.NAME],
-        ))
+        with lock:
+            failures.append((name, "an error occurred while importing score: {}".format(e)))
+        return
+
+    if medal is not None:
+        try:
+            judge.UpdateParticipant(eolymp.judge.UpdateParticipantInput(
+                contest_id=contest_id,
+                participant_id=participant_id,
+                participant=eolymp.judge.Participant(medal=MEDALS.get(medal, eolymp.judge.NO_MEDAL), name=name),
+                patch=[eolymp.judge.UpdateParticipantInput.MEDAL,eolymp.judge.UpdateParticipantInput.NAME],
+            ))
+        except Exception as e:
+            with lock:
+                failures.append((name, "an error occurred while updating medal: {}".format(e)))
+            return
+
+    with lock:
+        imported += 1
+        print("Imported total score {} for {}".format(score.score, name))
+
+
+with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+    for name, breakdown, medal in results:
+        if name in participant_ids:
+            executor.submit(import_result, name, breakdown, medal)
+
+print("Results are imported for {} participants, {} failed".format(imported, len(failures)))
+
+if failures:
+    print()
+    print("Failed participants:")
+    for name, error in failures:
+        print("  - {}: {}".format(name, error))
+
+    sys.exit(-1)
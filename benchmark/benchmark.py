@@ -0,0 +1,311 @@
+import argparse
+import csv
+import importlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mock_server
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SPACE = "bench"
+CONTEST = "1"
+TARGET_SPACE = "mirror"
+TARGET_CONTEST = "2"
+
+# version of eolymp SDK the benchmark is tested with
+SDK_VERSION = "0.11.26"
+
+# number of score records in every file imported by import-ghost-score
+SCORE_ROWS = 20
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='UTF8') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+# every scenario generates the data it needs in the mock server and input files in the working directory and returns
+# the script with its arguments and the number of processed items, used to calculate throughput
+def export_submissions(dataset, workdir):
+    dataset.contest(SPACE, CONTEST)
+    return ["submission-export/submission-export.py", SPACE, CONTEST, "submissions.csv"], dataset.submissions
+
+
+def rejudge_submissions(dataset, workdir):
+    dataset.contest(SPACE, CONTEST)
+    return ["submission-rejudge/submission-rejudge.py", "--wait", "--interval", "0.1", "--target", "1000",
+            SPACE, CONTEST], dataset.submissions
+
+
+def rejudge_submissions_async(dataset, workdir):
+    command, items = rejudge_submissions(dataset, workdir)
+    return command[:1] + ["--async"] + command[1:], items
+
+
+# half of the rows match existing members, the other half are new members
+def import_members(dataset, workdir):
+    dataset.space(SPACE)
+
+    first = dataset.members // 2
+    rows = [["user{}".format(first + i), "University {}".format(i % 7)] for i in range(dataset.members)]
+    write_csv(os.path.join(workdir, "members.csv"), ["eolymp_username", "attr_university"], rows)
+
+    return ["import-members/import-members.py", SPACE, "members.csv"], len(rows)
+
+
+# one score file for every member of the space, members beyond the number of participants are not in the contest yet
+def import_ghost_score(dataset, workdir):
+    contest = dataset.contest(SPACE, CONTEST)
+    members = list(dataset.space(SPACE).members)
+
+    header = ["time_offset", "total_score", "total_penalty"]
+    for problem in contest.problems:
+        header += ["p{}_score".format(problem["index"]), "p{}_percentage".format(problem["index"])]
+
+    os.mkdir(os.path.join(workdir, "scores"))
+    for i, member_id in enumerate(members):
+        rows = []
+        for t in range(SCORE_ROWS):
+            solved = (i + t) % (len(contest.problems) + 1)
+            row = [t * 600, solved * 100, 0]
+            for j in range(len(contest.problems)):
+                row += [100, 1] if j < solved else [0, 0]
+            rows.append(row)
+
+        write_csv(os.path.join(workdir, "scores", member_id + ".csv"), header, rows)
+
+    return ["import-ghost-score/import-ghost-score.py", "--batch", "scores", SPACE, CONTEST], len(members)
+
+
+def import_members_async(dataset, workdir):
+    command, items = import_members(dataset, workdir)
+    return command[:1] + ["--async"] + command[1:], items
+
+
+def import_ghosts(dataset, workdir):
+    dataset.contest(SPACE, CONTEST)
+    dataset.contest(TARGET_SPACE, TARGET_CONTEST)
+    return ["import-ghosts-from-another-contest/import-ghosts.py", SPACE, TARGET_SPACE, CONTEST, TARGET_CONTEST], dataset.participants
+
+
+def import_ghosts_async(dataset, workdir):
+    command, items = import_ghosts(dataset, workdir)
+    return command[:1] + ["--async"] + command[1:], items
+
+
+# results of new ghosts, every row is assigned as a new participant
+def import_contest_results(dataset, workdir):
+    contest = dataset.contest(SPACE, CONTEST)
+
+    header = ["name"] + ["p{}_score".format(problem["index"]) for problem in contest.problems] + ["medal"]
+    rows = []
+    for i in range(dataset.participants):
+        rows.append(["Ghost {}".format(i + 1)] + [(i * 7 + j * 13) % 101 for j in range(len(contest.problems))] +
+                    [["Gold", "Silver", "Bronze", ""][min(3, i // 10)]])
+
+    write_csv(os.path.join(workdir, "results.csv"), header, rows)
+
+    return ["basecamp/import-contest-results/import-contest-results.py", SPACE, CONTEST, "results.csv"], len(rows)
+
+
+# SDK classes, methods and message fields used by the code path each scenario runs, scenarios which can not work with
+# the installed eolymp package are skipped, see README for the SDK versions the scenarios are known to pass with
+REQUIREMENTS = {
+    "submission-export": ["universe.SpaceServiceClient", "judge.JudgeClient", "judge.Participant.display_name"],
+    "submission-rejudge": ["universe.SpaceServiceClient", "judge.JudgeClient.RetestSubmission"],
+    "import-members": ["universe.SpaceServiceClient", "cognito.UserServiceClient", "community.UpdateMemberInput.ATTRIBUTES"],
+    "import-ghost-score": ["universe.UniverseClient", "judge.JudgeClient.AssignParticipant", "judge.JudgeClient.ImportScore"],
+    "import-ghosts": ["universe.UniverseClient", "judge.JudgeClient.AssignParticipant", "judge.Participant.name"],
+    "import-contest-results": ["universe.UniverseClient", "judge.JudgeClient.AssignParticipant", "judge.Participant.name"],
+}
+
+SCENARIOS = {
+    "submission-export": export_submissions,
+    "submission-rejudge": rejudge_submissions,
+    "submission-rejudge-async": rejudge_submissions_async,
+    "import-members": import_members,
+    "import-members-async": import_members_async,
+    "import-ghost-score": import_ghost_score,
+    "import-ghosts": import_ghosts,
+    "import-ghosts-async": import_ghosts_async,
+    "import-contest-results": import_contest_results,
+}
+
+
+# whether the installed SDK has the symbol, given as "<package>.<name>[.<attribute>]" relative to eolymp package,
+# attributes of protobuf messages are looked up among their fields
+def sdk_has(symbol):
+    package, *names = symbol.split(".")
+
+    try:
+        value = importlib.import_module("eolymp." + package)
+    except ImportError:
+        return False
+
+    for name in names:
+        if hasattr(value, name):
+            value = getattr(value, name)
+            continue
+
+        fields = getattr(getattr(value, "DESCRIPTOR", None), "fields_by_name", {})
+        return name in fields
+
+    return True
+
+
+# symbols the script of the scenario needs but the installed SDK does not have
+def sdk_missing(name):
+    script = name[:-len("-async")] if name.endswith("-async") else name
+    return [symbol for symbol in REQUIREMENTS[script] if not sdk_has(symbol)]
+
+
+def sdk_version():
+    try:
+        return importlib.metadata.version("eolymp")
+    except importlib.metadata.PackageNotFoundError:
+        return "not installed"
+
+
+# runs the script and returns its exit code, wall time in seconds and peak RSS in megabytes, output is saved to the log
+def run(command, workdir, env, log, timeout):
+    started = time.monotonic()
+
+    with open(log, 'w', encoding='UTF8') as output:
+        proc = subprocess.Popen(command, cwd=workdir, env=env, stdout=output, stderr=subprocess.STDOUT)
+
+        timer = threading.Timer(timeout, proc.kill)
+        timer.start()
+
+        # wait4 returns resource usage of this process only, unlike getrusage(RUSAGE_CHILDREN)
+        _, status, usage = os.wait4(proc.pid, 0)
+        timer.cancel()
+        proc.returncode = os.waitstatus_to_exitcode(status)
+
+    elapsed = time.monotonic() - started
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = usage.ru_maxrss / 1024 if sys.platform != "darwin" else usage.ru_maxrss / 1024 / 1024
+
+    return proc.returncode, elapsed, rss
+
+
+def benchmark(name, args, extra):
+    server = mock_server.from_args(args).start()
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="eolymp-benchmark-") as workdir:
+            with server.dataset.lock:
+                command, items = SCENARIOS[name](server.dataset, workdir)
+
+            env = dict(os.environ, EOLYMP_API_URL=server.url, EOLYMP_TOKEN="benchmark")
+            env.pop("EOLYMP_CACHE", None)
+
+            log = os.path.join(workdir, "output.log")
+            code, elapsed, rss = run([sys.executable, os.path.join(ROOT, command[0])] + command[1:] + extra,
+                                     workdir, env, log, args.timeout)
+
+            if code != 0:
+                with open(log, encoding='UTF8') as file:
+                    tail = file.readlines()[-20:]
+
+                print("Script {} has failed with exit code {}:".format(command[0], code))
+                for line in tail:
+                    print("  " + line.rstrip())
+
+            stats = server.stats.snapshot()
+            changes = dict(server.dataset.changes)
+    finally:
+        server.stop()
+
+    return {
+        "scenario": name,
+        "exit_code": code,
+        "wall_time": round(elapsed, 3),
+        "rpcs": stats["total"],
+        "rpcs_per_second": round(stats["total"] / elapsed, 1),
+        "items": items,
+        "items_per_second": round(items / elapsed, 1),
+        "peak_rss_mb": round(rss, 1),
+        "statuses": stats["statuses"],
+        "rpcs_by_method": stats["rpcs"],
+        "changes": changes,
+    }
+
+
+parser = argparse.ArgumentParser(
+    description="Run scripts against the local mock API and measure wall time, number of API requests, throughput and memory",
+    epilog="See more at https://github.com/eolymp/scripts/blob/main/benchmark/README.md",
+)
+parser.add_argument('-s', '--scenario', action='append', choices=list(SCENARIOS), default=[],
+                    help="Scenario to run, may be repeated (default: all scenarios)")
+parser.add_argument('-a', '--args', default="", metavar="ARGS",
+                    help="Arguments added to every script, for example \"--rate-limit 50 --retries 10\"")
+parser.add_argument('--timeout', type=float, default=600, metavar="SECONDS", help="Time after which a script is stopped (default: 600)")
+parser.add_argument('--json', metavar="PATH", help="Save results into a JSON file, to compare them with another run")
+mock_server.add_arguments(parser)
+
+args = parser.parse_args()
+mock_server.validate(parser, args)
+
+if not hasattr(os, "wait4"):
+    parser.error("benchmark requires os.wait4, which is not available on this platform")
+
+scenarios = args.scenario or list(SCENARIOS)
+if not args.scenario and importlib.util.find_spec("aiohttp") is None:
+    print("Skipping asyncio scenarios, they require aiohttp package")
+    scenarios = [name for name in scenarios if not name.endswith("-async")]
+
+print("SDK: eolymp {} (scenarios are known to pass with eolymp=={})".format(sdk_version(), SDK_VERSION))
+skipped = {}
+for name in scenarios:
+    missing = sdk_missing(name)
+    if missing:
+        skipped[name] = "installed eolymp SDK does not have {}".format(", ".join(missing))
+        print("Skipping {} scenario, {}".format(name, skipped[name]))
+
+scenarios = [name for name in scenarios if name not in skipped]
+if not scenarios:
+    print("No scenario can run with the installed eolymp SDK, install it using \"pip install eolymp=={}\"".format(SDK_VERSION))
+    sys.exit(-1)
+
+print("Dataset: {} participants, {} submissions, {} members, {} problems".format(
+    args.participants, args.submissions, args.members, args.problems))
+print("Faults: {}ms latency (+{}ms jitter), {:.1%} errors, rate limit {}".format(
+    args.latency, args.jitter, args.error_rate, "{} RPS".format(args.server_rate_limit) if args.server_rate_limit else "off"))
+print()
+
+results = []
+for name in scenarios:
+    print("Running {}...".format(name))
+    results.append(benchmark(name, args, shlex.split(args.args)))
+
+print()
+print("{:<24} {:>6} {:>9} {:>7} {:>9} {:>8} {:>10} {:>9} {:>6} {:>6}".format(
+    "scenario", "exit", "wall, s", "RPCs", "RPC/s", "items", "items/s", "RSS, MB", "429", "503"))
+for result in results:
+    print("{:<24} {:>6} {:>9.2f} {:>7} {:>9.1f} {:>8} {:>10.1f} {:>9.1f} {:>6} {:>6}".format(
+        result["scenario"], result["exit_code"], result["wall_time"], result["rpcs"], result["rpcs_per_second"],
+        result["items"], result["items_per_second"], result["peak_rss_mb"],
+        result["statuses"].get("429", 0), result["statuses"].get("503", 0)))
+
+if args.json:
+    with open(args.json + ".part", 'w', encoding='UTF8') as file:
+        json.dump({"arguments": vars(args), "sdk": sdk_version(), "results": results, "skipped": skipped}, file, indent=2)
+
+    os.replace(args.json + ".part", args.json)
+    print()
+    print("Results are saved to \"{}\"".format(args.json))
+
+if any(result["exit_code"] != 0 for result in results):
+    sys.exit(-1)
@@ -0,0 +1,638 @@
+import argparse
+import collections
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import common.client
+
+# generated contests start at this time, submissions are spread over the following 5 hours
+START = 1700000000
+DURATION = 5 * 3600
+
+LANGS = ["cpp:17-gnu10", "python:3-python3.10", "java:1.21-openjdk", "pascal:3.2-fpc", "csharp:8-dotnet"]
+VERDICTS = ["ACCEPTED", "WRONG_ANSWER", "TIME_LIMIT_EXCEEDED", "RUNTIME_ERROR"]
+
+ATTRIBUTES = [
+    {"key": "university", "label": "University", "type": "STRING", "index": 1},
+    {"key": "year", "label": "Year of study", "type": "NUMBER", "index": 2},
+]
+
+
+class NotFound(Exception):
+    pass
+
+
+def timestamp(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+# value of the filtered field, nested fields are named in camel case, for example "userNickname" is user.nickname
+def field(item, name):
+    value = item.get(name)
+    if value is None and re.match(r"^[a-z]+[A-Z]", name):
+        prefix, rest = re.match(r"^([a-z]+)([A-Z].*)$", name).groups()
+        value = (item.get(prefix) or {}).get(rest[0].lower() + rest[1:])
+
+    return value if value is not None else ""
+
+
+def test(value, expression):
+    op = expression.get("is", "EQUAL")
+    expected = expression.get("value", "")
+
+    if isinstance(value, bool):
+        expected = expected is True or expected == "true"
+    elif isinstance(value, (int, float)):
+        expected = float(expected or 0)
+
+    if op in ("EQUAL", "NONE"):
+        return value == expected
+    if op == "NOT_EQUAL":
+        return value != expected
+    if op == "GREATER_THAN":
+        return value > expected
+    if op == "GREATER_THAN_EQUAL":
+        return value >= expected
+    if op == "LESS_THAN":
+        return value < expected
+    if op == "LESS_THAN_EQUAL":
+        return value <= expected
+    if op == "CONTAINING":
+        return str(expected).lower() in str(value).lower()
+    if op == "STARTING":
+        return str(value).lower().startswith(str(expected).lower())
+
+    return False
+
+
+# checks the item against list filters the same way as the API: EQUAL expressions of the same field match any of the
+# values, other expressions must all match, filters the mock does not know are ignored
+def matches(item, filters):
+    for name, expressions in filters.items():
+        if not isinstance(expressions, list):
+            continue
+
+        value = field(item, name)
+        equal = [e for e in expressions if e.get("is", "EQUAL") in ("EQUAL", "NONE")]
+
+        if equal and not any(test(value, e) for e in equal):
+            return False
+
+        if not all(test(value, e) for e in expressions if e not in equal):
+            return False
+
+    return True
+
+
+def page(items, payload):
+    filters = payload.get("filters") or {}
+    if filters:
+        items = [item for item in items if matches(item, filters)]
+
+    offset = int(payload.get("offset") or 0)
+    size = int(payload.get("size") or 10)
+
+    return {"total": len(items), "items": items[offset:offset + size]}
+
+
+# contest with generated problems, participants and submissions, participants are linked to members of the space and
+# their score is calculated from generated submissions until another score is imported
+class Contest:
+    def __init__(self, dataset, space, contest_id):
+        rnd = random.Random("{}/{}/{}".format(dataset.seed, space.key, contest_id))
+
+        self.id = contest_id
+        self.problems = []
+        self.participants = collections.OrderedDict()
+        self.submissions = []
+        self.submission_index = {}
+        self.attempts = {}
+        self.scores = {}
+        self.judge_queue = []
+
+        for i in range(dataset.problems):
+            self.problems.append({"id": dataset.new_id(), "contestId": contest_id, "index": i + 1, "score": 100})
+
+        members = list(space.members.values())
+        for i in range(dataset.participants):
+            member_id = members[i]["id"] if i < len(members) else dataset.new_id()
+            self.add_participant(dataset.new_id(), member_id, "Participant {}".format(i + 1), False)
+
+        participant_ids = list(self.participants)
+        for i in range(dataset.submissions if participant_ids else 0):
+            participant_id = rnd.choice(participant_ids)
+            problem = rnd.choice(self.problems)
+            submitted_at = START + i * DURATION // max(1, dataset.submissions)
+            verdict = VERDICTS[0] if rnd.random() < 0.4 else rnd.choice(VERDICTS[1:])
+            score = 100 if verdict == "ACCEPTED" else rnd.randint(0, 90)
+
+            submission_id = dataset.new_id()
+            submission = {
+                "id": submission_id,
+                "contestId": contest_id,
+                "problemId": problem["id"],
+                "participantId": participant_id,
+                "submittedAt": timestamp(submitted_at),
+                "lang": rnd.choice(LANGS),
+                "sourceUrl": "{}/sources/{}/{}/{}".format(dataset.url, space.key, contest_id, submission_id),
+                "status": "COMPLETE",
+                "verdict": verdict,
+                "score": score,
+                "percentage": score / 100,
+            }
+
+            self.submissions.append(submission)
+            self.submission_index[submission_id] = submission
+
+            # attempts and time of the first accepted submission, the generated score is built from them
+            attempts = self.attempts.setdefault((participant_id, problem["id"]), [0, None])
+            if attempts[1] is None:
+                attempts[0] += 1
+                if verdict == "ACCEPTED":
+                    attempts[1] = submitted_at - START
+
+    def add_participant(self, participant_id, member_id, name, ghost):
+        self.participants[participant_id] = {
+            "id": participant_id,
+            "contestId": self.id,
+            "memberId": member_id,
+            "name": name,
+            "displayName": name,
+            "ghost": ghost,
+            "status": "COMPLETE",
+        }
+
+    def score(self, participant_id):
+        if participant_id in self.scores:
+            return max(self.scores[participant_id], key=lambda s: s.get("validAfter", 0))
+
+        total = {"score": 0, "penalty": 0, "breakdown": []}
+        for problem in self.problems:
+            attempts, solved_in = self.attempts.get((participant_id, problem["id"]), (0, None))
+            if not attempts:
+                continue
+
+            item = {"problemId": problem["id"], "attempts": attempts, "percentage": 0}
+            if solved_in is not None:
+                item.update(score=100, percentage=1, solved=True, solvedIn=solved_in,
+                            penalty=solved_in // 60 + 20 * (attempts - 1))
+                total["score"] += item["score"]
+                total["penalty"] += item["penalty"]
+
+            total["breakdown"].append(item)
+
+        return total
+
+    def retest(self, submission_id, judge_time):
+        submission = self.submission_index.get(submission_id)
+        if submission is None:
+            raise NotFound()
+
+        submission.update(status="PENDING", verdict="NO_VERDICT")
+        heapq.heappush(self.judge_queue, (time.monotonic() + judge_time, submission_id))
+
+    # completes retests which are due, called before submissions are read
+    def judge(self):
+        now = time.monotonic()
+        while self.judge_queue and self.judge_queue[0][0] <= now:
+            _, submission_id = heapq.heappop(self.judge_queue)
+            self.submission_index[submission_id].update(status="COMPLETE", verdict="ACCEPTED", score=100, percentage=1)
+
+
+# space with generated members, contests are generated when they are requested for the first time
+class Space:
+    def __init__(self, dataset, key):
+        self.key = key
+        self.url = "{}/spaces/{}".format(dataset.url, key)
+        self.issuer_url = self.url + "/oauth"
+        self.members = collections.OrderedDict()
+        self.contests = {}
+
+        rnd = random.Random("{}/{}".format(dataset.seed, key))
+        for i in range(dataset.members):
+            member_id = dataset.new_id()
+            self.members[member_id] = {
+                "id": member_id,
+                "name": "User {}".format(i),
+                "displayName": "User {}".format(i),
+                "rating": rnd.randint(1000, 2500),
+                "user": {"issuer": self.issuer_url, "subject": str(i + 1), "nickname": "user{}".format(i), "name": "User {}".format(i)},
+                "attributes": [{"attributeKey": "university", "string": rnd.choice(["MIT", "Harvard", "KPI", "ETH"])}],
+            }
+
+    def describe(self):
+        return {"id": self.key, "key": self.key, "url": self.url, "issuerUrl": self.issuer_url, "name": "Space {}".format(self.key)}
+
+
+# everything the mock server knows, all changes are made under a single lock
+class Dataset:
+    def __init__(self, participants=100, submissions=1000, members=100, problems=10, users=None, judge_time=0, seed=0):
+        self.participants = participants
+        self.submissions = submissions
+        self.members = members
+        self.problems = problems
+        self.users = users if users is not None else 2 * members
+        self.judge_time = judge_time
+        self.seed = seed
+        self.url = ""
+        self.spaces = {}
+        self.ids = itertools.count(1000000)
+        self.lock = threading.Lock()
+        self.changes = collections.Counter()
+
+    def new_id(self):
+        return str(next(self.ids))
+
+    def space(self, key):
+        if key not in self.spaces:
+            self.spaces[key] = Space(self, key)
+
+        return self.spaces[key]
+
+    def contest(self, key, contest_id):
+        space = self.space(key)
+        if contest_id not in space.contests:
+            space.contests[contest_id] = Contest(self, space, contest_id)
+
+        return space.contests[contest_id]
+
+    # cognito users are not stored, user N has username "userN" and ID N + 1
+    def user(self, i):
+        return {"id": str(i + 1), "username": "user{}".format(i), "name": "User {}".format(i), "email": "user{}@example.com".format(i)}
+
+    def list_users(self, payload):
+        usernames = [e.get("value", "") for e in (payload.get("filters") or {}).get("username", [])]
+        if not usernames:
+            offset = int(payload.get("offset") or 0)
+            size = int(payload.get("size") or 10)
+            return {"total": self.users, "items": [self.user(i) for i in range(offset, min(self.users, offset + size))]}
+
+        items = []
+        for username in usernames:
+            found = re.match(r"^user(\d+)$", username.lower())
+            if found and int(found.group(1)) < self.users:
+                items.append(self.user(int(found.group(1))))
+
+        return {"total": len(items), "items": items}
+
+
+def participant(contest, participant_id):
+    if participant_id not in contest.participants:
+        raise NotFound()
+
+    return contest.participants[participant_id]
+
+
+def member(space, member_id):
+    if member_id not in space.members:
+        raise NotFound()
+
+    return space.members[member_id]
+
+
+def lookup_space(dataset, payload, key):
+    return {"space": dataset.space(key).describe()}
+
+
+def list_users(dataset, payload):
+    return dataset.list_users(payload)
+
+
+def describe_contest(dataset, payload, key, contest_id):
+    contest = dataset.contest(key, contest_id)
+    return {"contest": {"id": contest.id, "name": "Contest {}".format(contest.id), "problemCount": len(contest.problems),
+                        "startsAt": timestamp(START), "endsAt": timestamp(START + DURATION), "duration": DURATION}}
+
+
+def list_problems(dataset, payload, key, contest_id):
+    problems = dataset.contest(key, contest_id).problems
+    return {"total": len(problems), "items": problems}
+
+
+def list_participants(dataset, payload, key, contest_id):
+    return page(list(dataset.contest(key, contest_id).participants.values()), payload)
+
+
+def assign_participant(dataset, payload, key, contest_id):
+    contest = dataset.contest(key, contest_id)
+    data = payload.get("participant") or {}
+
+    participant_id = dataset.new_id()
+    member_id = data.get("memberId") or payload.get("memberId") or dataset.new_id()
+    name = data.get("name") or data.get("displayName") or "Participant {}".format(participant_id)
+    contest.add_participant(participant_id, member_id, name, bool(data.get("ghost")))
+
+    dataset.changes["participants"] += 1
+    return {"participantId": participant_id}
+
+
+def update_participant(dataset, payload, key, contest_id, participant_id):
+    item = participant(dataset.contest(key, contest_id), participant_id)
+    item.update({k: v for k, v in (payload.get("participant") or {}).items() if k != "id"})
+    if "name" in (payload.get("participant") or {}):
+        item["displayName"] = item["name"]
+
+    dataset.changes["participant_updates"] += 1
+    return {}
+
+
+def describe_score(dataset, payload, key, contest_id, participant_id):
+    contest = dataset.contest(key, contest_id)
+    participant(contest, participant_id)
+    return {"score": contest.score(participant_id)}
+
+
+def import_score(dataset, payload, key, contest_id, participant_id):
+    contest = dataset.contest(key, contest_id)
+    participant(contest, participant_id)
+
+    scores = payload.get("scores") or []
+    contest.scores.setdefault(participant_id, []).extend(scores)
+
+    dataset.changes["scores"] += len(scores)
+    return {}
+
+
+def list_submissions(dataset, payload, key, contest_id):
+    contest = dataset.contest(key, contest_id)
+    contest.judge()
+    return page(contest.submissions, payload)
+
+
+def retest_submission(dataset, payload, key, contest_id, submission_id):
+    contest = dataset.contest(key, contest_id)
+    contest.judge()
+    contest.retest(submission_id, dataset.judge_time)
+
+    dataset.changes["retests"] += 1
+    return {}
+
+
+def list_members(dataset, payload, key):
+    return page(list(dataset.space(key).members.values()), payload)
+
+
+def create_member(dataset, payload, key):
+    space = dataset.space(key)
+    data = payload.get("member") or {}
+
+    member_id = dataset.new_id()
+    space.members[member_id] = dict(data, id=member_id)
+
+    dataset.changes["members"] += 1
+    return {"memberId": member_id}
+
+
+def update_member(dataset, payload, key, member_id):
+    item = member(dataset.space(key), member_id)
+    item.update({k: v for k, v in (payload.get("member") or {}).items() if k != "id"})
+
+    dataset.changes["member_updates"] += 1
+    return {}
+
+
+def describe_member(dataset, payload, key, member_id):
+    return {"member": member(dataset.space(key), member_id)}
+
+
+def list_attributes(dataset, payload, key):
+    return page(ATTRIBUTES, payload)
+
+
+SPACE = r"/spaces/(?P<key>[^/]+)"
+CONTEST = SPACE + r"/contests/(?P<contest_id>[^/]+)"
+
+# API methods served by the mock, paths are the same as in eolymp SDK
+ROUTES = [
+    ("GET", r"/spaces/__lookup/(?P<key>[^/]+)", "universe.LookupSpace", lookup_space),
+    ("GET", r"/users", "cognito.ListUsers", list_users),
+    ("GET", CONTEST, "judge.DescribeContest", describe_contest),
+    ("GET", CONTEST + r"/problems", "judge.ListProblems", list_problems),
+    ("GET", CONTEST + r"/participants", "judge.ListParticipants", list_participants),
+    ("POST", CONTEST + r"/participants", "judge.AssignParticipant", assign_participant),
+    ("PUT", CONTEST + r"/participants/(?P<participant_id>[^/]+)", "judge.UpdateParticipant", update_participant),
+    ("GET", CONTEST + r"/participants/(?P<participant_id>[^/]+)/score", "judge.DescribeScore", describe_score),
+    ("POST", CONTEST + r"/participants/(?P<participant_id>[^/]+)/scores", "judge.ImportScore", import_score),
+    ("GET", CONTEST + r"/submissions", "judge.ListSubmissions", list_submissions),
+    ("POST", CONTEST + r"/submissions/(?P<submission_id>[^/]+)/retest", "judge.RetestSubmission", retest_submission),
+    ("GET", SPACE + r"/members", "community.ListMembers", list_members),
+    ("POST", SPACE + r"/members", "community.CreateMember", create_member),
+    ("GET", SPACE + r"/members/(?P<member_id>[^/]+)", "community.DescribeMember", describe_member),
+    ("POST", SPACE + r"/members/(?P<member_id>[^/]+)", "community.UpdateMember", update_member),
+    ("GET", SPACE + r"/attributes", "community.ListAttributes", list_attributes),
+]
+
+ROUTES = [(method, re.compile("^" + path + "$"), name, handler) for method, path, name, handler in ROUTES]
+
+
+# number of requests by API method and response status, sources are counted separately from API requests
+class Stats:
+    def __init__(self):
+        self.rpcs = collections.Counter()
+        self.statuses = collections.Counter()
+        self.sources = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+
+    def record(self, name, status, size):
+        with self.lock:
+            if name == "sources":
+                self.sources += 1
+            else:
+                self.rpcs[name] += 1
+
+            self.statuses[status] += 1
+            self.bytes_sent += size
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "rpcs": dict(self.rpcs),
+                "total": sum(self.rpcs.values()),
+                "statuses": {str(k): v for k, v in self.statuses.items()},
+                "sources": self.sources,
+                "bytes_sent": self.bytes_sent,
+            }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # headers and body are written separately, with Nagle's algorithm every keep-alive response would wait for
+    # a delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def dispatch(self, method):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+
+        # the body is always read, otherwise the next request on the same connection is broken
+        length = int(self.headers.get("content-length") or 0)
+        body = self.rfile.read(length) if length else b""
+
+        if method == "GET" and url.path == "/__stats":
+            return self.reply("stats", 200, server.stats.snapshot())
+
+        found = re.match(r"^/sources/(?P<key>[^/]+)/(?P<contest_id>[^/]+)/(?P<submission_id>[^/]+)$", url.path)
+        if method == "GET" and found:
+            return self.reply("sources", 200, None, "// source of submission {}\n".format(found.group("submission_id")).encode())
+
+        for route_method, path, name, handler in ROUTES:
+            found = path.match(url.path)
+            if route_method == method and found:
+                break
+        else:
+            return self.reply("unknown", 404, {"error": "not found"})
+
+        # injected faults: rate limit, latency and random errors
+        wait = server.limiter.take()
+        if wait:
+            return self.reply(name, 429, {"error": "too many requests"}, headers={"retry-after": str(math.ceil(wait))})
+
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        if server.error_rate and random.random() < server.error_rate:
+            return self.reply(name, 503, {"error": "service unavailable"})
+
+        try:
+            if method == "GET":
+                query = urllib.parse.parse_qs(url.query).get("q")
+                payload = json.loads(query[0]) if query else {}
+            else:
+                payload = json.loads(body or b"{}")
+        except ValueError:
+            return self.reply(name, 400, {"error": "invalid request"})
+
+        try:
+            with server.dataset.lock:
+                response = handler(server.dataset, payload, **{k: urllib.parse.unquote(v) for k, v in found.groupdict().items()})
+        except NotFound:
+            return self.reply(name, 404, {"error": "not found"})
+
+        self.reply(name, 200, response)
+
+    def reply(self, name, status, response, content=None, headers=None):
+        if content is None:
+            content = json.dumps(response, separators=(",", ":")).encode()
+
+        self.send_response(status)
+        self.send_header("content-type", "application/json" if response is not None else "text/plain")
+        self.send_header("content-length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+        self.server.stats.record(name, status, len(content))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+# local stand-in for the API, `latency` seconds (plus up to `jitter` seconds) are added to every API request,
+# `error_rate` of requests fail with 503 and requests over `rate_limit` per second are rejected with 429
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, dataset, latency=0, jitter=0, error_rate=0, rate_limit=0, verbose=False):
+        super().__init__(address, Handler)
+
+        self.dataset = dataset
+        self.dataset.url = self.url
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.limiter = common.client.RateLimiter(rate_limit)
+        self.verbose = verbose
+        self.stats = Stats()
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(*self.server_address[:2])
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def add_arguments(parser):
+    parser.add_argument('--participants', type=int, default=100, help="Number of participants in every contest (default: 100)")
+    parser.add_argument('--submissions', type=int, default=1000, help="Number of submissions in every contest (default: 1000)")
+    parser.add_argument('--members', type=int, default=100, help="Number of members in every space (default: 100)")
+    parser.add_argument('--problems', type=int, default=10, help="Number of problems in every contest (default: 10)")
+    parser.add_argument('--latency', type=float, default=0, metavar="MS", help="Delay added to every API request (default: 0)")
+    parser.add_argument('--jitter', type=float, default=0, metavar="MS", help="Random delay added on top of the latency (default: 0)")
+    parser.add_argument('--error-rate', type=float, default=0, metavar="RATE", help="Share of API requests failed with 503, from 0 to 1 (default: 0)")
+    parser.add_argument('--server-rate-limit', type=float, default=0, metavar="RPS",
+                        help="Maximum number of API requests per second, other requests are rejected with 429 (default: unlimited)")
+    parser.add_argument('--judge-time', type=float, default=0, metavar="SECONDS", help="Time it takes to retest a submission (default: 0)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the generated data (default: 0)")
+
+
+def validate(parser, args):
+    if min(args.participants, args.submissions, args.members, args.problems) < 0:
+        parser.error("dataset sizes can not be negative")
+
+    if min(args.latency, args.jitter, args.server_rate_limit, args.judge_time) < 0:
+        parser.error("latency, jitter, rate limit and judge time can not be negative")
+
+    if not 0 <= args.error_rate <= 1:
+        parser.error("error rate must be between 0 and 1")
+
+
+# creates the server from parsed arguments, port 0 picks a free port
+def from_args(args, host="127.0.0.1", port=0, verbose=False):
+    dataset = Dataset(participants=args.participants, submissions=args.submissions, members=args.members,
+                      problems=args.problems, judge_time=args.judge_time, seed=args.seed)
+
+    return MockServer((host, port), dataset, latency=args.latency / 1000, jitter=args.jitter / 1000,
+                      error_rate=args.error_rate, rate_limit=args.server_rate_limit, verbose=verbose)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local mock of Eolymp API for benchmarks and tests",
+        epilog="See more at https://github.com/eolymp/scripts/blob/main/benchmark/README.md",
+    )
+    parser.add_argument('--host', default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8080, help="Port to listen on (default: 8080)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Print every request")
+    add_arguments(parser)
+
+    args = parser.parse_args()
+    validate(parser, args)
+
+    server = from_args(args, args.host, args.port, args.verbose)
+    print("Mock API is listening on {}, run scripts with EOLYMP_API_URL={}".format(server.url, server.url))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.stats.snapshot(), indent=2))
@@ -0,0 +1,149 @@
+import asyncio
+import collections
+import os
+import signal
+import urllib.parse
+
+from google.protobuf import json_format
+
+from common import client
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+# asyncio counterpart of common.client.Client: service clients created with it return coroutines, so
+# `await judge.DescribeScore(...)` sends the request without blocking the event loop, retry and rate limit policies
+# are the same as in common.client.Client
+#
+# the client has to be used as an async context manager, which opens and closes the connection pool
+class AsyncClient:
+    def __init__(self, token="", headers=None, retry=5, pool_size=100, rate_limit=0, timeout=60, backoff=0.5, max_backoff=30):
+        if aiohttp is None:
+            raise Exception("asyncio mode requires aiohttp package, install it using \"pip install aiohttp\"")
+
+        self._token = token
+        self._headers = headers if headers is not None else {}
+        self.retry = retry
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = client.RateLimiter(rate_limit)
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size),
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def request(self, url, method, request_data, response_symbol, **kwargs):
+        headers = dict(self._headers)
+        headers["content-type"] = "application/json"
+
+        if self._token:
+            headers["authorization"] = "Bearer " + self._token
+
+        url = client.api_url(url)
+        data = json_format.MessageToJson(request_data)
+        if method == "GET":
+            url = url + (("?q=" + urllib.parse.quote(data)) if data != "{}" else "")
+            data = None
+
+        for attempt in range(self.retry + 1):
+            wait = self.limiter.take()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self.limiter.take()
+
+            try:
+                async with self.session.request(method, url, data=data, headers=headers, **kwargs) as resp:
+                    status = resp.status
+                    content = await resp.read()
+                    retry_after = resp.headers.get("retry-after")
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                # the request never reached the server if connection could not be established
+                retryable = method == "GET" or isinstance(e, aiohttp.ClientConnectorError)
+                if attempt == self.retry or not retryable:
+                    raise
+
+                await asyncio.sleep(client.backoff(attempt, self.backoff, self.max_backoff))
+                continue
+
+            if status == 200:
+                response = response_symbol()
+                json_format.Parse(content, response, ignore_unknown_fields=True)
+                return response
+
+            if not client.retryable(method, status) or attempt == self.retry:
+                raise Exception("Got non-200 response: {}".format(status))
+
+            await asyncio.sleep(client.backoff(attempt, self.backoff, self.max_backoff, retry_after))
+
+
+# asyncio counterpart of common.client.paginate, `fetch` returns a coroutine, pages are yielded in the listing order
+async def paginate(fetch, size, prefetch):
+    out = await fetch(0, size)
+    total = out.total
+    offset = size
+
+    yield out.items
+
+    pending = collections.deque()
+    try:
+        while pending or offset < total:
+            while offset < total and len(pending) < prefetch:
+                pending.append(asyncio.ensure_future(fetch(offset, size)))
+                offset += size
+
+            out = await pending.popleft()
+            total = max(total, out.total)
+
+            yield out.items
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+# adds arguments to switch the script to asyncio mode
+def add_arguments(parser):
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Send requests from a single asyncio event loop instead of thread pools, requires aiohttp package")
+
+
+# creates the async client from parsed arguments, see common.client.from_args
+def from_args(parser, args, concurrency=1):
+    if aiohttp is None:
+        parser.error("--async requires aiohttp package, install it using \"pip install aiohttp\"")
+
+    return AsyncClient(
+        token=os.getenv("EOLYMP_TOKEN"),
+        retry=args.retries,
+        pool_size=args.pool_size or max(10, concurrency),
+        rate_limit=args.rate_limit,
+    )
+
+
+# runs the coroutine, on Ctrl-C the coroutine is cancelled (so it can flush its state in `finally` blocks) and
+# KeyboardInterrupt is raised once it has finished
+def run(main):
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(main)
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, task.cancel)
+    except NotImplementedError:
+        pass  # signal handlers are not supported on Windows, Ctrl-C stops the loop right away
+
+    try:
+        return loop.run_until_complete(task)
+    except asyncio.CancelledError:
+        raise KeyboardInterrupt
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
@@ -0,0 +1,155 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+# how long entries of every kind are kept, in seconds
+TTL = {
+    "space": 24 * 3600,
+    "contest": 3600,
+    "problems": 3600,
+    "participants": 600,
+}
+
+
+# on-disk cache of API responses in a SQLite file, entries expire after the TTL of their kind counted from the time
+# they were first stored (updating an entry does not extend it) and least recently used entries are evicted once the
+# file grows over `max_size` bytes, with `refresh` cached entries are ignored but fresh responses are still stored
+class Cache:
+    # number of keys looked up with a single query, below SQLite limit of query parameters
+    batch = 500
+
+    def __init__(self, path, max_size=64 * 1024 * 1024, refresh=False):
+        self.max_size = max_size
+        self.refresh = refresh
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (kind TEXT, key TEXT, value BLOB, size INTEGER, "
+                        "expires_at REAL, accessed_at REAL, PRIMARY KEY (kind, key))")
+
+    def get(self, kind, key):
+        if self.refresh:
+            return None
+
+        with self.lock:
+            row = self.db.execute("SELECT value, expires_at FROM entries WHERE kind = ? AND key = ?", (kind, key)).fetchone()
+            if not row:
+                return None
+
+            if row[1] < time.time():
+                self.db.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+                return None
+
+            self.db.execute("UPDATE entries SET accessed_at = ? WHERE kind = ? AND key = ?", (time.time(), kind, key))
+
+        return pickle.loads(row[0])
+
+    # returns a dict with values of the keys found in the cache
+    def get_many(self, kind, keys):
+        if self.refresh:
+            return {}
+
+        found = {}
+        now = time.time()
+
+        with self.lock:
+            for i in range(0, len(keys), self.batch):
+                batch = keys[i:i + self.batch]
+                rows = self.db.execute("SELECT key, value FROM entries WHERE kind = ? AND key IN ({}) AND expires_at >= ?"
+                                       .format(", ".join("?" * len(batch))), [kind] + batch + [now]).fetchall()
+
+                self.db.executemany("UPDATE entries SET accessed_at = ? WHERE kind = ? AND key = ?",
+                                    [(now, kind, key) for key, _ in rows])
+
+                for key, value in rows:
+                    found[key] = pickle.loads(value)
+
+        return found
+
+    def set(self, kind, key, value):
+        self.set_many(kind, {key: value})
+
+    # stores entries in a single transaction, an existing entry keeps its expiration time unless it has already expired
+    def set_many(self, kind, entries):
+        now = time.time()
+        rows = []
+        for key, value in entries.items():
+            data = pickle.dumps(value)
+            rows.append((kind, key, data, len(data), now + TTL[kind], now))
+
+        with self.lock:
+            self.db.execute("BEGIN")
+            try:
+                self.db.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (kind, key) DO UPDATE SET "
+                                    "value = excluded.value, size = excluded.size, accessed_at = excluded.accessed_at, "
+                                    "expires_at = CASE WHEN expires_at < excluded.accessed_at "
+                                    "THEN excluded.expires_at ELSE expires_at END", rows)
+                self.evict()
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+            self.db.execute("COMMIT")
+
+    def evict(self):
+        self.db.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        for kind, key, size in self.db.execute("SELECT kind, key, size FROM entries ORDER BY accessed_at").fetchall():
+            self.db.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+            total -= size
+            if total <= self.max_size:
+                break
+
+
+cache = None
+
+
+def add_arguments(parser):
+    parser.add_argument('--cache', metavar="PATH", default=os.getenv("EOLYMP_CACHE"),
+                        help="Keep spaces, contests, problems and participants in a local cache file, so the next run does not request them again (default: $EOLYMP_CACHE)")
+    parser.add_argument('--cache-size', type=float, default=64, metavar="MB", help="Maximum size of the cache file (default: 64)")
+    parser.add_argument('--refresh', action='store_true', help="Request data from the API again instead of using local caches and indexes")
+
+
+def configure(parser, args):
+    global cache
+
+    if args.cache_size <= 0:
+        parser.error("cache size must be positive")
+
+    if args.cache:
+        cache = Cache(args.cache, int(args.cache_size * 1024 * 1024), args.refresh)
+
+
+def get(kind, key):
+    return cache.get(kind, key) if cache is not None else None
+
+
+def put(kind, key, value):
+    if cache is not None:
+        cache.set(kind, key, value)
+
+
+def get_many(kind, keys):
+    return cache.get_many(kind, keys) if cache is not None else {}
+
+
+def put_many(kind, entries):
+    if cache is not None and entries:
+        cache.set_many(kind, entries)
+
+
+# returns cached value or loads and caches it, without the cache the value is always loaded
+def cached(kind, key, load):
+    value = get(kind, key)
+    if value is None:
+        value = load()
+        put(kind, key, value)
+
+    return value
@@ -0,0 +1,245 @@
+import collections
+import concurrent.futures
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+import requests.adapters
+import urllib3.exceptions
+from google.protobuf import json_format
+
+import eolymp.core
+import eolymp.judge
+import eolymp.universe
+
+from common import cache
+
+# responses to requests which may succeed if sent again, gateway errors (502, 504) may come after the request was
+# processed, so only 429 and 503 which reject the request are retried for requests which change data
+TRANSIENT_STATUS = [429, 502, 503, 504]
+REJECTED_STATUS = [429, 503]
+
+
+def retryable(method, status):
+    return status in (TRANSIENT_STATUS if method == "GET" else REJECTED_STATUS)
+
+
+# whether the request failed before it was sent: connection could not be established or timed out while connecting
+def connect_failed(e):
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, urllib3.exceptions.ConnectTimeoutError)  # NewConnectionError is its subclass
+
+API_URL = "https://api.eolymp.com"
+
+
+# EOLYMP_API_URL environment variable sends requests to another server instead of the API (for example, to the mock
+# server in benchmark directory), space URLs are returned by the server, so only the default URL has to be replaced
+def api_url(url):
+    base = os.getenv("EOLYMP_API_URL")
+    if base and url.startswith(API_URL):
+        return base.rstrip("/") + url[len(API_URL):]
+
+    return url
+
+
+# exponential backoff with full jitter, server's Retry-After is used as the lower bound
+def backoff(attempt, base, cap, retry_after=None):
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+
+    try:
+        delay = max(delay, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+
+    return delay
+
+
+# token bucket shared by all threads using the client, allows `rate` requests per second with bursts up to `burst`
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # takes a token, returns 0 on success or number of seconds to wait before trying again
+    def take(self):
+        if not self.rate:
+            return 0
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        wait = self.take()
+        while wait:
+            time.sleep(wait)
+            wait = self.take()
+
+
+# drop-in replacement for eolymp.core.HttpClient which keeps connections alive in a pool shared by all threads,
+# retries transient errors with jittered exponential backoff and limits the request rate
+#
+# GET requests which fail with 429, 502, 503, 504 or a network error are retried, requests which change data are only
+# retried on 429, 503 and when the connection could not be established, because the server may have already applied
+# the change, other errors are raised right away with the same message as eolymp.core.HttpClient
+class Client(eolymp.core.HttpClient):
+    def __init__(self, token="", headers=None, retry=5, pool_size=10, rate_limit=0, timeout=60, backoff=0.5, max_backoff=30):
+        super().__init__(token=token, headers=headers)
+
+        self.retry = retry
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = RateLimiter(rate_limit)
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, url, method, request_data, response_symbol, **kwargs):
+        headers = dict(self._headers)
+        headers["content-type"] = "application/json"
+
+        if self._token:
+            headers["authorization"] = "Bearer " + self._token
+
+        kwargs.setdefault("timeout", self.timeout)
+
+        url = api_url(url)
+        data = json_format.MessageToJson(request_data)
+        if method == "GET":
+            url = url + (("?q=" + urllib.parse.quote(data)) if data != "{}" else "")
+            data = None
+
+        for attempt in range(self.retry + 1):
+            self.limiter.acquire()
+
+            try:
+                resp = self.session.request(url=url, method=method, data=data, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retry or not (method == "GET" or connect_failed(e)):
+                    raise
+
+                time.sleep(backoff(attempt, self.backoff, self.max_backoff))
+                continue
+
+            if resp.status_code == 200:
+                response = response_symbol()
+                json_format.Parse(resp.content, response, ignore_unknown_fields=True)
+                return response
+
+            if not retryable(method, resp.status_code) or attempt == self.retry:
+                raise Exception("Got non-200 response: {}".format(resp.status_code))
+
+            time.sleep(backoff(attempt, self.backoff, self.max_backoff, resp.headers.get("retry-after")))
+
+    # downloads a file which is not an API method (for example, a source code) with the same timeout, retries and rate
+    # limit, `session` may be given to download through another connection pool
+    def download(self, url, session=None):
+        session = session or self.session
+
+        for attempt in range(self.retry + 1):
+            self.limiter.acquire()
+
+            try:
+                resp = session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retry:
+                    raise
+
+                time.sleep(backoff(attempt, self.backoff, self.max_backoff))
+                continue
+
+            if resp.status_code == 200:
+                return resp.content
+
+            if not retryable("GET", resp.status_code) or attempt == self.retry:
+                resp.raise_for_status()
+                raise Exception("Got non-200 response: {}".format(resp.status_code))
+
+            time.sleep(backoff(attempt, self.backoff, self.max_backoff, resp.headers.get("retry-after")))
+
+
+# adds arguments to tune the client to the script's argument parser
+def add_arguments(parser):
+    parser.add_argument('--retries', type=int, default=5, help="Number of retries for a failed API request (default: 5)")
+    parser.add_argument('--rate-limit', type=float, default=0, metavar="RPS", help="Maximum number of API requests per second (default: unlimited)")
+    parser.add_argument('--pool-size', type=int, metavar="N", help="Number of API connections kept alive (default: depends on the number of jobs)")
+    cache.add_arguments(parser)
+
+
+# creates the client from parsed arguments, pool size defaults to the number of concurrent requests made by the script
+def from_args(parser, args, concurrency=1):
+    if args.retries < 0 or args.rate_limit < 0:
+        parser.error("number of retries and rate limit can not be negative")
+
+    if args.pool_size is not None and args.pool_size < 1:
+        parser.error("pool size must be at least 1")
+
+    cache.configure(parser, args)
+
+    return Client(
+        token=os.getenv("EOLYMP_TOKEN"),
+        retry=args.retries,
+        pool_size=args.pool_size or max(10, concurrency),
+        rate_limit=args.rate_limit,
+    )
+
+
+# cache key of the contest, contest IDs are only unique within the space
+def contest_key(judge, contest_id):
+    return "{}/{}".format(getattr(judge, "url", ""), contest_id)
+
+
+def lookup_space(universe, key):
+    return cache.cached("space", key, lambda: universe.LookupSpace(eolymp.universe.LookupSpaceInput(key=key)).space)
+
+
+def describe_contest(judge, contest_id):
+    return cache.cached("contest", contest_key(judge, contest_id),
+                        lambda: judge.DescribeContest(eolymp.judge.DescribeContestInput(contest_id=contest_id)).contest)
+
+
+def list_problems(judge, contest_id):
+    return cache.cached("problems", contest_key(judge, contest_id),
+                        lambda: list(judge.ListProblems(eolymp.judge.ListProblemsInput(contest_id=contest_id)).items))
+
+
+# pages through a listing keeping up to `prefetch` pages in flight, once the first page reports the total number of
+# items the remaining offsets are requested in parallel, pages are yielded in the listing order
+def paginate(fetch, size, prefetch):
+    out = fetch(0, size)
+    total = out.total
+    offset = size
+
+    yield out.items
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=prefetch) as executor:
+        pending = collections.deque()
+
+        while pending or offset < total:
+            while offset < total and len(pending) < prefetch:
+                pending.append(executor.submit(fetch, offset, size))
+                offset += size
+
+            out = pending.popleft().result()
+            total = max(total, out.total)
+
+            yield out.items
@@ -0,0 +1,35 @@
+import eolymp.atlas
+
+
+# short label of the submission verdict used in exported tables and rejudge summary
+def verdict_label(status, verdict):
+    if status == eolymp.atlas.Submission.PENDING:
+        return 'PENDING'
+    if status == eolymp.atlas.Submission.TESTING:
+        return 'TESTING'
+    if status == eolymp.atlas.Submission.TIMEOUT:
+        return 'TIMEOUT'
+    if status == eolymp.atlas.Submission.COMPLETE:
+        if verdict == eolymp.atlas.Submission.ACCEPTED:
+            return 'AC'
+        if verdict == eolymp.atlas.Submission.WRONG_ANSWER:
+            return 'WA'
+        if verdict == eolymp.atlas.Submission.TIME_LIMIT_EXCEEDED:
+            return 'TL'
+        if verdict == eolymp.atlas.Submission.CPU_EXHAUSTED:
+            return 'TL'
+        if verdict == eolymp.atlas.Submission.MEMORY_OVERFLOW:
+            return 'MO'
+        if verdict == eolymp.atlas.Submission.RUNTIME_ERROR:
+            return 'RE'
+        return 'UNKNOWN'
+    if status == eolymp.atlas.Submission.ERROR:
+        return 'CE'
+    if status == eolymp.atlas.Submission.FAILURE:
+        return 'FAILURE'
+
+    # statuses added to the API later are shown by their name
+    try:
+        return eolymp.atlas.Submission.Status.Name(status)
+    except ValueError:
+        return 'UNKNOWN'
@@ -1,6 +1,9 @@
 import csv
 import os
 import sys
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import eolymp.core
 import eolymp.universe
@@ -8,16 +11,52 @@ import eolymp.community
 import eolymp.judge
 import eolymp.wellknown
 
-client = eolymp.core.HttpClient(token=os.getenv("EOLYMP_TOKEN"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import common.client
+
+parser = argparse.ArgumentParser(
+    description="Import score records for Ghost members",
+    usage="%(prog)s [options] <space-key> <member-id> <contest-id> <score-csv-file>\n"
+          "       %(prog)s [options] --batch <manifest-or-directory> <space-key> <contest-id>",
+    epilog="See more at https://github.com/eolymp/scripts/blob/main/import-ghost-score/README.md",
+)
+parser.add_argument('-b', '--batch', metavar="PATH",
+                    help="Import score for many members: CSV manifest with columns member_id and score_file, or directory with <member-id>.csv score files")
+parser.add_argument('-j', '--jobs', type=int, default=8, help="Number of members imported concurrently in batch mode (default: 8)")
+parser.add_argument('-g', '--granularity', type=int, default=0, metavar="SECONDS",
+                    help="Keep at most one score record per time interval unless total score or penalty changes (default: keep all changes)")
+parser.add_argument('--chunk-size', type=int, default=512, metavar="KB",
+                    help="Maximum size of a single import request, longer timelines are imported in several requests (default: 512)")
+common.client.add_arguments(parser)
+parser.add_argument('space_key', help="Space Key")
+parser.add_argument('member_id', nargs='?', help="Ghost's member ID")
+parser.add_argument('contest_id', help="Contest ID")
+parser.add_argument('score_file', nargs='?', help="CSV file with score")
+
+args = parser.parse_args()
+
+if args.batch and (args.member_id or args.score_file):
+    parser.error("member-id and score-csv-file can not be used with --batch")
+
+if not args.batch and not (args.member_id and args.score_file):
+    parser.error("Some parameters are missing")
+
+if args.jobs < 1:
+    parser.error("--jobs must be at least 1")
+
+if args.granularity < 0:
+    parser.error("--granularity can not be negative")
+
+if args.chunk_size < 1:
+    parser.error("--chunk-size must be at least 1")
+
+client = common.client.from_args(parser, args, args.jobs)
 universe = eolymp.universe.UniverseClient(client)
 
 
 def usage():
     print()
-    print("USAGE:")
-    print("  {} <space-key> <member-id> <contest-id> <score-csv-file>".format(sys.argv[0]))
-    print()
-    print("See more at https://github.com/eolymp/scripts/blob/main/import-ghost-score/README.md")
+    parser.print_usage()
     print()
 
 
@@ -31,24 +70,203 @@ def validate_header(header):
                         "participant (for ICPC, equals to number of problems)")
 
 
-# open import file
-if len(sys.argv) < 5:
-    print("Some parameters are missing")
-    usage()
-    sys.exit(-1)
+# problem columns: field name and converter
+PROBLEM_FIELDS = [("score", int), ("penalty", int), ("percentage", float), ("attempts", int), ("solved_in", int)]
+
+
+# column plan compiled once from the header: positions of total columns and, for every problem in the contest,
+# positions and converters of its columns
+def compile_plan(header):
+    validate_header(header)
+
+    position = {name: i for i, name in enumerate(header)}
+
+    problems = []
+    for index in problem_index_to_id:
+        prefix = "p" + str(index) + "_"
+        if prefix + "score" not in position:
+            continue
+
+        columns = [(field, position[prefix + field], convert) for field, convert in PROBLEM_FIELDS if prefix + field in position]
+        problems.append((problem_index_to_id[index], columns))
+
+    return {
+        "header": header,
+        "time_offset": position["time_offset"],
+        "total_score": position["total_score"],
+        "total_penalty": position.get("total_penalty"),
+        "problems": problems,
+    }
+
+
+# find the column which can not be converted, used to report errors
+def invalid_column(plan, row, line):
+    columns = [(plan["time_offset"], int), (plan["total_score"], int)]
+    if plan["total_penalty"] is not None:
+        columns.append((plan["total_penalty"], int))
+
+    for _, fields in plan["problems"]:
+        columns += [(pos, convert) for _, pos, convert in fields]
+
+    for pos, convert in columns:
+        try:
+            convert(row[pos])
+        except ValueError:
+            return Exception("line {}, column \"{}\": invalid value \"{}\"".format(line, plan["header"][pos], row[pos]))
+
+    return Exception("line {}: invalid row".format(line))
+
+
+# convert CSV rows into score records using the column plan
+def parse_scores(reader, plan):
+    width = len(plan["header"])
+    time_offset = plan["time_offset"]
+    total_score = plan["total_score"]
+    total_penalty = plan["total_penalty"]
+    problems = plan["problems"]
+
+    for row in reader:
+        if not row:
+            continue
+
+        if len(row) != width:
+            raise Exception("line {}: expected {} columns, found {}".format(reader.line_num, width, len(row)))
+
+        try:
+            score = eolymp.judge.Score(valid_after=int(row[time_offset]), score=int(row[total_score]))
+            if total_penalty is not None:
+                score.penalty = int(row[total_penalty])
+
+            for problem_id, columns in problems:
+                score.breakdown.append(eolymp.judge.Score.Problem(problem_id=problem_id, **{field: convert(row[pos]) for field, pos, convert in columns}))
+        except ValueError:
+            raise invalid_column(plan, row, reader.line_num)
+
+        yield score
+
+
+# read score records from CSV file, returns compacted records and number of rows in the file
+def read_scores(path):
+    with open(path) as file:
+        reader = csv.reader(file)
+        plan = compile_plan(next(reader, []))
+
+        return compact_scores(parse_scores(reader, plan), args.granularity)
+
+
+# records are the same if they differ only in time
+def same_score(a, b):
+    return a.score == b.score and a.penalty == b.penalty and list(a.breakdown) == list(b.breakdown)
+
+
+# drop records which do not change the score, with granularity records within the same time interval are merged into
+# one unless total score or penalty changes, merged record keeps time of the first record and state of the last one,
+# returns compacted records and number of records read
+def compact_scores(scores, granularity=0):
+    compacted = []
+    count = 0
+
+    for score in scores:
+        count += 1
+
+        if compacted:
+            last = compacted[-1]
+
+            if same_score(last, score):
+                continue
+
+            if granularity and last.valid_after // granularity == score.valid_after // granularity \
+                    and last.score == score.score and last.penalty == score.penalty:
+                score.valid_after = last.valid_after
+                compacted[-1] = score
+                continue
+
+        compacted.append(score)
+
+    return compacted, count
+
+
+# split records into chunks which fit into a single request
+def chunk_scores(scores, limit):
+    chunk = []
+    size = 0
+
+    for score in scores:
+        record = score.ByteSize()
+        if chunk and size + record > limit:
+            yield chunk
+            chunk = []
+            size = 0
+
+        chunk.append(score)
+        size += record
+
+    if chunk:
+        yield chunk
+
+
+# import records in chunks, chunks are imported in order
+def import_scores(participant_id, scores):
+    for chunk in chunk_scores(scores, args.chunk_size * 1024):
+        judge.ImportScore(eolymp.judge.ImportScoreInput(contest_id=args.contest_id, participant_id=participant_id, scores=chunk))
+
+
+# list of (member ID, score file) from the manifest or the directory with score files
+def read_batch(path):
+    entries = []
+
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            member_id, ext = os.path.splitext(name)
+            if ext.lower() == ".csv":
+                entries.append((member_id, os.path.join(path, name)))
+    else:
+        with open(path) as file:
+            reader = csv.DictReader(file)
+            if "member_id" not in (reader.fieldnames or []) or "score_file" not in reader.fieldnames:
+                raise Exception("manifest must contain columns \"member_id\" and \"score_file\"")
+
+            for row in reader:
+                if not row["member_id"]:
+                    continue
+
+                # score files are relative to the manifest
+                entries.append((row["member_id"], os.path.join(os.path.dirname(path), row["score_file"])))
+
+    seen = set()
+    for member_id, _ in entries:
+        if member_id in seen:
+            raise Exception("member {} is listed more than once".format(member_id))
+        seen.add(member_id)
+
+    return entries
+
+
+# find participants for members in batches, returns map member ID -> participant
+def find_participants(member_ids, batch=50):
+    mm = {}
+
+    for i in range(0, len(member_ids), batch):
+        filters = []
+        for member_id in member_ids[i:i + batch]:
+            match = eolymp.wellknown.ExpressionID(value=member_id)
+            setattr(match, "is", eolymp.wellknown.ExpressionID.EQUAL)
+            filters.append(match)
+
+        out = judge.ListParticipants(eolymp.judge.ListParticipantsInput(contest_id=args.contest_id, size=len(filters),
+                                                                        filters=eolymp.judge.ListParticipantsInput.Filter(member_id=filters)))
+        for item in out.items:
+            mm[item.member_id] = item
+
+    return mm
 
-space_key = sys.argv[1]
-member_id = sys.argv[2]
-contest_id = sys.argv[3]
-score_file = sys.argv[4]
 
 # lookup space
 try:
-    out = universe.LookupSpace(eolymp.universe.LookupSpaceInput(key=space_key))
-    space = out.space
+    space = common.client.lookup_space(universe, args.space_key)
     print("Found space \"{}\"".format(space.name))
 except Exception as e:
-    print("An error occurred while loading space with key \"{}\": {}".format(space_key, e))
+    print("An error occurred while loading space with key \"{}\": {}".format(args.space_key, e))
     usage()
     sys.exit(-1)
 
@@ -59,109 +277,134 @@ community = eolymp.community.MemberServiceClient(client, space.url)
 problem_index_to_id = {}
 
 try:
-    out = judge.DescribeContest(eolymp.judge.DescribeContestInput(contest_id=contest_id))
-    contest = out.contest
+    contest = common.client.describe_contest(judge, args.contest_id)
     print("Found contest \"{}\"".format(contest.name))
 
-    out = judge.ListProblems(eolymp.judge.ListProblemsInput(contest_id=contest_id))
-    for item in out.items:
+    for item in common.client.list_problems(judge, args.contest_id):
         print("  - Found problem #{} with index \"{}\"".format(item.id, item.index))
         problem_index_to_id[item.index] = item.id
 except Exception as e:
-    print("An error occurred while loading contest with ID \"{}\": {}".format(contest_id, e))
+    print("An error occurred while loading contest with ID \"{}\": {}".format(args.contest_id, e))
     usage()
     sys.exit(-1)
 
 
+# batch mode: import score for every member from the manifest
+if args.batch:
+    try:
+        entries = read_batch(args.batch)
+    except Exception as e:
+        print("An error occurred while reading batch \"{}\": {}".format(args.batch, e))
+        usage()
+        sys.exit(-1)
+
+    print("Found {} score files".format(len(entries)))
+
+    try:
+        participants = find_participants([member_id for member_id, _ in entries])
+    except Exception as e:
+        print("An error occurred while loading participants of contest with ID \"{}\": {}".format(args.contest_id, e))
+        sys.exit(-1)
+
+    print("Found {} participants, {} members are not participating in the contest".format(len(participants), len(entries) - len(participants)))
+
+    lock = threading.Lock()
+    failures = []
+    imported = 0
+
+    def import_member(member_id, score_file):
+        global imported
+
+        try:
+            scores, rows = read_scores(score_file)
+        except Exception as e:
+            return "score file \"{}\" is invalid: {}".format(score_file, e)
+
+        try:
+            if member_id in participants:
+                participant_id = participants[member_id].id
+            else:
+                out = judge.AssignParticipant(eolymp.judge.AssignParticipantInput(contest_id=args.contest_id, participant=eolymp.judge.Participant(member_id=member_id)))
+                participant_id = out.participant_id
+                print("Participant #{} created for member {}".format(participant_id, member_id))
+
+            import_scores(participant_id, scores)
+        except Exception as e:
+            return "an error occurred while importing score: {}".format(e)
+
+        with lock:
+            imported += 1
+            print("{} score records ({} rows) are imported for member {} ({} of {})".format(len(scores), rows, member_id, imported, len(entries)))
+
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [(member_id, executor.submit(import_member, member_id, score_file)) for member_id, score_file in entries]
+
+        for member_id, future in futures:
+            error = future.result()
+            if error:
+                print("Member {}: {}".format(member_id, error))
+                failures.append((member_id, error))
+
+    print("Score is imported for {} members, {} failed".format(imported, len(failures)))
+
+    if failures:
+        print()
+        print("Failed members:")
+        for member_id, error in failures:
+            print("  - {}: {}".format(member_id, error))
+
+        sys.exit(-1)
+
+    sys.exit(0)
+
+
 # lookup member
 try:
-    out = community.DescribeMember(eolymp.community.DescribeMemberInput(member_id=member_id))
+    out = community.DescribeMember(eolymp.community.DescribeMemberInput(member_id=args.member_id))
     member = out.member
     print("Found member \"{}\"".format(member.name))
 except Exception as e:
-    print("An error occurred while loading member with ID \"{}\": {}".format(member_id, e))
+    print("An error occurred while loading member with ID \"{}\": {}".format(args.member_id, e))
     usage()
     sys.exit(-1)
 
 
 # lookup participant
 try:
-    match = eolymp.wellknown.ExpressionID(value=member_id)
-    setattr(match, "is", eolymp.wellknown.ExpressionID.EQUAL)
-
-    out = judge.ListParticipants(eolymp.judge.ListParticipantsInput(contest_id=contest_id, filters=eolymp.judge.ListParticipantsInput.Filter(member_id=[match])))
-    if len(out.items) > 0:
-        participant = out.items[0]
+    participants = find_participants([args.member_id])
+    if args.member_id in participants:
+        participant = participants[args.member_id]
         print("Found participant \"{}\"".format(participant.name))
         participant_id = participant.id
     else:
         print("Member is not participating in the contest, adding...")
-        out = judge.AssignParticipant(eolymp.judge.AssignParticipantInput(contest_id=contest_id, participant=eolymp.judge.Participant(member_id=member_id)))
+        out = judge.AssignParticipant(eolymp.judge.AssignParticipantInput(contest_id=args.contest_id, participant=eolymp.judge.Participant(member_id=args.member_id)))
         print("Participant #{} created".format(out.participant_id))
         participant_id = out.participant_id
 
 except Exception as e:
-    print("An error occurred while loading contest with ID \"{}\": {}".format(contest_id, e))
+    print("An error occurred while loading contest with ID \"{}\": {}".format(args.contest_id, e))
     usage()
     sys.exit(-1)
 
 
-# open score file
+# read scores
 try:
-    file = open(score_file)
-    reader = csv.reader(file)
-except Exception as e:
-    print("An error occurred while reading score file \"{}\": {}".format(score_file, e))
+    scores, rows = read_scores(args.score_file)
+except OSError as e:
+    print("An error occurred while reading score file \"{}\": {}".format(args.score_file, e))
     usage()
     sys.exit(-1)
-
-# validate header
-header = next(reader)
-try:
-    validate_header(header)
 except Exception as e:
-    print("Score file \"{}\" has invalid format: {}".format(score_file, e))
+    print("Score file \"{}\" has invalid format: {}".format(args.score_file, e))
     usage()
     sys.exit(-1)
 
-
-# read scores
-scores = []
-
-for row in reader:
-    data = dict(zip(header, row))
-
-    if "total_score" not in data:
-        continue
-
-    score = eolymp.judge.Score(valid_after=int(data["time_offset"]), score=int(data["total_score"]))
-    if "total_penalty" in data:
-        score.penalty = int(data["total_penalty"])
-
-    for index in problem_index_to_id:
-        prefix = "p" + str(index)
-        if prefix + "_score" not in data:
-            continue
-
-        breakdown = eolymp.judge.Score.Problem(problem_id=problem_index_to_id[index], score=int(data[prefix + "_score"]))
-        if prefix + "_penalty" in data:
-            breakdown.penalty = int(data[prefix + "_penalty"])
-        if prefix + "_percentage" in data:
-            breakdown.percentage = float(data[prefix + "_percentage"])
-        if prefix + "_attempts" in data:
-            breakdown.attempts = int(data[prefix + "_attempts"])
-        if prefix + "_solved_in" in data:
-            breakdown.solved_in = int(data[prefix + "_solved_in"])
-
-        score.breakdown.append(breakdown)
-
-    scores.append(score)
-
 # import score
 try:
-    judge.ImportScore(eolymp.judge.ImportScoreInput(contest_id=contest_id, participant_id=participant_id, scores=scores))
+    import_scores(participant_id, scores)
 except Exception as e:
     print("An error occurred while importing score: {}".format(e))
     sys.exit(-1)
 
-print("{} score records are imported".format(len(scores)))
+print("{} score records ({} rows) are imported".format(len(scores), rows))
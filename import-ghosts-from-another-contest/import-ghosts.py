@@ -1,27 +1,55 @@
 import csv
 import os
 import sys
+import time
+import json
+import hashlib
+import argparse
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import eolymp.community
 import eolymp.core
 import eolymp.universe
 import eolymp.judge
 
-client = eolymp.core.HttpClient(token=os.getenv("EOLYMP_TOKEN"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import common.aio
+import common.cache
+import common.client
+
+parser = argparse.ArgumentParser(description="Mirror participants of one contest as ghosts in another contest")
+parser.add_argument('--fetch-jobs', type=int, default=8, help="Number of scores fetched from the source contest concurrently (default: 8)")
+parser.add_argument('--import-jobs', type=int, default=4, help="Number of ghosts created and imported into the target contest concurrently (default: 4)")
+parser.add_argument('--mapping', metavar="PATH",
+                    help="File with ghosts created by previous runs (default: ghosts-<contest-id-from>-<contest-id-to>.jsonl)")
+common.client.add_arguments(parser)
+common.aio.add_arguments(parser)
+parser.add_argument('space_key_from', help="Key of the space with the source contest")
+parser.add_argument('space_key_to', help="Key of the space with the target contest")
+parser.add_argument('contest_id_from', help="Source contest ID")
+parser.add_argument('contest_id_to', help="Target contest ID")
+
+args = parser.parse_args()
+
+if args.fetch_jobs < 1 or args.import_jobs < 1:
+    parser.error("--fetch-jobs and --import-jobs must be at least 1")
+
+client = common.client.from_args(parser, args, args.fetch_jobs + args.import_jobs)
+async_client = common.aio.from_args(parser, args, args.fetch_jobs + args.import_jobs) if args.use_async else None
 universe = eolymp.universe.UniverseClient(client)
 
 
 def usage():
     print()
-    print("USAGE:")
-    print("  {} <space-key-from> <space-key-to> <contest-id-from> <contest-id-to>".format(sys.argv[0]))
+    parser.print_usage()
     print()
 
 
 def load_space(key):
     try:
-        out = universe.LookupSpace(eolymp.universe.LookupSpaceInput(key=key))
-        space = out.space
+        space = common.client.lookup_space(universe, key)
         print("Found space \"{}\"".format(space.name))
         return space
     except Exception as e:
@@ -33,12 +61,10 @@ def load_space(key):
 def load_contest(judge, contest_id, mode):
     try:
         problem_dict = {}
-        out = judge.DescribeContest(eolymp.judge.DescribeContestInput(contest_id=contest_id))
-        contest = out.contest
+        contest = common.client.describe_contest(judge, contest_id)
         print("Found contest \"{}\"".format(contest.name))
 
-        out = judge.ListProblems(eolymp.judge.ListProblemsInput(contest_id=contest_id))
-        for item in out.items:
+        for item in common.client.list_problems(judge, contest_id):
             print("  - Found problem #{} with index \"{}\"".format(item.id, item.index))
             if mode:
                 problem_dict[item.id] = item.index
@@ -52,6 +78,11 @@ def load_contest(judge, contest_id, mode):
 
 
 def load_participants(judge, contest_id):
+    return common.cache.cached("participants", common.client.contest_key(judge, contest_id),
+                               lambda: list_participants(judge, contest_id))
+
+
+def list_participants(judge, contest_id):
     participants = []
     offset = 0
     all_participants = []
@@ -65,35 +96,86 @@ def load_participants(judge, contest_id):
     return all_participants
 
 
-# open import file
-if len(sys.argv) < 5:
-    print("Some parameters are missing")
-    usage()
-    sys.exit(-1)
+# progress of the pipeline, printed at most every 2 seconds and once at the end
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.fetched = 0
+        self.added = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.started = time.time()
+        self.printed = 0
+        self.lock = threading.Lock()
 
-space_key_from = sys.argv[1]
-space_key_to = sys.argv[2]
-contest_id_from = sys.argv[3]
-contest_id_to = sys.argv[4]
+    def update(self, **counters):
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
 
-space_from = load_space(space_key_from)
-space_to = load_space(space_key_to)
+            if time.time() - self.printed >= 2:
+                self.print()
 
-judge_from = eolymp.judge.JudgeClient(client, space_from.url)
-judge_to = eolymp.judge.JudgeClient(client, space_to.url)
+    def print(self):
+        self.printed = time.time()
+        elapsed = max(self.printed - self.started, 0.001)
+        print("Fetched {} of {} scores, {} ghosts imported, {} unchanged, {} skipped, {} failed, {:.1f} participants/s".format(
+            self.fetched, self.total, self.added, self.unchanged, self.skipped, self.failed,
+            (self.added + self.unchanged + self.skipped + self.failed) / elapsed))
 
-community_from = eolymp.community.MemberServiceClient(client, space_from.url)
-community_to = eolymp.community.MemberServiceClient(client, space_to.url)
 
-contest_from, problems_from = load_contest(judge_from, contest_id_from, True)
-contest_to, problems_to = load_contest(judge_to, contest_id_to, False)
+# ghosts created in the target contest: source participant ID -> member_id, participant_id and hash of imported
+# score, every change is appended to the file right away, so ghosts are not created twice if the script is interrupted
+class Mapping:
+    def __init__(self, path):
+        self.path = path
+        self.ghosts = {}
+        self.lock = threading.Lock()
 
-participants = load_participants(judge_from, contest_id_from)
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # last line may be incomplete if the script was interrupted
+
+                    self.ghosts.setdefault(entry.pop("source"), {}).update(entry)
+
+        self.file = open(path, "a")
+
+    def get(self, source_id):
+        with self.lock:
+            return dict(self.ghosts.get(source_id, {}))
+
+    def set(self, source_id, **fields):
+        with self.lock:
+            self.ghosts.setdefault(source_id, {}).update(fields)
+            self.file.write(json.dumps(dict(source=source_id, **fields)) + "\n")
+            self.file.flush()
+
+    # rewrite the file with one line per ghost
+    def close(self):
+        self.file.close()
+
+        with open(self.path + ".part", "w") as f:
+            for source_id, entry in self.ghosts.items():
+                f.write(json.dumps(dict(source=source_id, **entry)) + "\n")
+
+        os.replace(self.path + ".part", self.path)
+
+
+def score_hash(scores):
+    h = hashlib.sha256()
+    for score in scores:
+        h.update(score.SerializeToString(deterministic=True))
+
+    return h.hexdigest()
 
-for participant in participants:
-    score = judge_from.DescribeScore(eolymp.judge.DescribeScoreInput(contest_id=contest_id_from,
-                                                                     participant_id=participant[0],
-                                                                     mode=eolymp.judge.Score.LATEST)).score
+
+# score records for the target contest, one record for every solved problem in order of solving
+def build_scores(score):
     scores = []
     problems = []
     for b in score.breakdown:
@@ -102,16 +184,6 @@ for participant in participants:
                                                  percentage=b.percentage, attempts=b.attempts, penalty=b.penalty,
                                                  solved_in=b.solved_in, solved=True)
             problems += [(b.solved_in, b.problem_id, problem, b)]
-    if len(problems) == 0:
-        continue
-    new_member = eolymp.community.Member(ghost=eolymp.community.Ghost(name=participant[1]))
-    member_id = community_to.CreateMember(eolymp.community.CreateMemberInput(member=new_member)).member_id
-    participant_id = judge_to.AssignParticipant(
-        eolymp.judge.AssignParticipantInput(
-            contest_id=contest_id_to,
-            participant=eolymp.judge.Participant(member_id=member_id, name=participant[1])
-        )
-    ).participant_id
 
     problems.sort()
     problem_list = []
@@ -125,6 +197,228 @@ for participant in participants:
         scores += [eolymp.judge.Score(valid_after=b.solved_in, score=total_score, penalty=total_penalty,
                                       breakdown=problem_list)]
 
-    result = judge_to.ImportScore(eolymp.judge.ImportScoreInput(contest_id=contest_id_to, participant_id=participant_id,
-                                                                scores=scores))
-    print(participant[1], "was added")
+    return scores
+
+
+def describe_score_input(participant):
+    return eolymp.judge.DescribeScoreInput(contest_id=contest_id_from, participant_id=participant[0],
+                                           mode=eolymp.judge.Score.LATEST)
+
+
+# decides if the fetched score has to be imported, returns score records and their hash, or None if there is nothing
+# to import
+def fetched(participant, score):
+    scores = build_scores(score)
+
+    if len(scores) == 0:
+        progress.update(fetched=1, skipped=1)
+        return None
+
+    checksum = score_hash(scores)
+    if mapping.get(participant[0]).get("score") == checksum:
+        progress.update(fetched=1, unchanged=1)
+        return None
+
+    progress.update(fetched=1)
+    return scores, checksum
+
+
+def fetch_failed(participant, e):
+    failures.append((participant, "an error occurred while loading score: {}".format(e)))
+    progress.update(fetched=1, failed=1)
+
+
+def import_failed(participant, e):
+    failures.append((participant, "an error occurred while adding ghost: {}".format(e)))
+    progress.update(failed=1)
+
+
+def imported(participant, ghost):
+    print(participant[1], "was updated" if ghost.get("participant_id") else "was added")
+    progress.update(added=1)
+
+
+# first stage: fetch score of the source participant and pass it to the second stage
+def fetch_score(participant):
+    try:
+        found = fetched(participant, judge_from.DescribeScore(describe_score_input(participant)).score)
+    except Exception as e:
+        fetch_failed(participant, e)
+        found = None
+
+    if found is None:
+        queue.release()
+        return
+
+    import_pool.submit(import_ghost, participant, *found)
+
+
+# second stage: create ghost in the target space unless it was created before, and import its score
+def import_ghost(participant, scores, checksum):
+    ghost = mapping.get(participant[0])
+
+    try:
+        member_id = ghost.get("member_id")
+        if not member_id:
+            new_member = eolymp.community.Member(ghost=eolymp.community.Ghost(name=participant[1]))
+            member_id = community_to.CreateMember(eolymp.community.CreateMemberInput(member=new_member)).member_id
+            mapping.set(participant[0], member_id=member_id)
+
+        participant_id = ghost.get("participant_id")
+        if not participant_id:
+            participant_id = judge_to.AssignParticipant(
+                eolymp.judge.AssignParticipantInput(
+                    contest_id=contest_id_to,
+                    participant=eolymp.judge.Participant(member_id=member_id, name=participant[1])
+                )
+            ).participant_id
+            mapping.set(participant[0], participant_id=participant_id)
+
+        judge_to.ImportScore(eolymp.judge.ImportScoreInput(contest_id=contest_id_to, participant_id=participant_id,
+                                                           scores=scores))
+        mapping.set(participant[0], score=checksum)
+    except Exception as e:
+        import_failed(participant, e)
+        return
+    finally:
+        queue.release()
+
+    imported(participant, ghost)
+
+
+# asyncio mode: every participant is mirrored by its own task, semaphores limit the number of requests in flight at
+# each stage and the number of participants between the stages
+async def mirror_ghost(participant, services, limits):
+    judge_from_async, judge_to_async, community_to_async = services
+    queue_limit, fetch_limit, import_limit = limits
+
+    async with queue_limit:
+        try:
+            async with fetch_limit:
+                score = (await judge_from_async.DescribeScore(describe_score_input(participant))).score
+
+            found = fetched(participant, score)
+        except Exception as e:
+            fetch_failed(participant, e)
+            return
+
+        if found is None:
+            return
+
+        scores, checksum = found
+        ghost = mapping.get(participant[0])
+
+        async with import_limit:
+            try:
+                member_id = ghost.get("member_id")
+                if not member_id:
+                    new_member = eolymp.community.Member(ghost=eolymp.community.Ghost(name=participant[1]))
+                    member_id = (await community_to_async.CreateMember(eolymp.community.CreateMemberInput(member=new_member))).member_id
+                    mapping.set(participant[0], member_id=member_id)
+
+                participant_id = ghost.get("participant_id")
+                if not participant_id:
+                    participant_id = (await judge_to_async.AssignParticipant(
+                        eolymp.judge.AssignParticipantInput(
+                            contest_id=contest_id_to,
+                            participant=eolymp.judge.Participant(member_id=member_id, name=participant[1])
+                        )
+                    )).participant_id
+                    mapping.set(participant[0], participant_id=participant_id)
+
+                await judge_to_async.ImportScore(eolymp.judge.ImportScoreInput(contest_id=contest_id_to, participant_id=participant_id,
+                                                                               scores=scores))
+                mapping.set(participant[0], score=checksum)
+            except Exception as e:
+                import_failed(participant, e)
+                return
+
+        imported(participant, ghost)
+
+
+async def mirror_ghosts():
+    async with async_client:
+        services = (
+            eolymp.judge.JudgeClient(async_client, space_from.url),
+            eolymp.judge.JudgeClient(async_client, space_to.url),
+            eolymp.community.MemberServiceClient(async_client, space_to.url),
+        )
+
+        limits = (
+            asyncio.Semaphore(2 * (args.fetch_jobs + args.import_jobs)),
+            asyncio.Semaphore(args.fetch_jobs),
+            asyncio.Semaphore(args.import_jobs),
+        )
+
+        tasks = [asyncio.ensure_future(mirror_ghost(participant, services, limits)) for participant in participants]
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # on Ctrl-C wait for cancelled tasks, so nothing is written to the mapping after it's closed
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+space_key_from = args.space_key_from
+space_key_to = args.space_key_to
+contest_id_from = args.contest_id_from
+contest_id_to = args.contest_id_to
+
+space_from = load_space(space_key_from)
+space_to = load_space(space_key_to)
+
+judge_from = eolymp.judge.JudgeClient(client, space_from.url)
+judge_to = eolymp.judge.JudgeClient(client, space_to.url)
+
+community_from = eolymp.community.MemberServiceClient(client, space_from.url)
+community_to = eolymp.community.MemberServiceClient(client, space_to.url)
+
+contest_from, problems_from = load_contest(judge_from, contest_id_from, True)
+contest_to, problems_to = load_contest(judge_to, contest_id_to, False)
+
+participants = load_participants(judge_from, contest_id_from)
+print("Found {} participants in the source contest".format(len(participants)))
+
+mapping = Mapping(args.mapping or "ghosts-{}-{}.jsonl".format(contest_id_from, contest_id_to))
+if mapping.ghosts:
+    print("Found {} ghosts created by previous runs in \"{}\"".format(len(mapping.ghosts), mapping.path))
+
+failures = []
+progress = Progress(len(participants))
+
+if async_client:
+    try:
+        common.aio.run(mirror_ghosts())
+    except KeyboardInterrupt:
+        mapping.close()
+        progress.print()
+        print("Interrupted, ghosts added so far are saved to \"{}\", run the script again to continue".format(mapping.path))
+        sys.exit(-1)
+else:
+    # scores are fetched by one pool and imported by another one, the number of participants between the stages is
+    # limited so fetched scores do not pile up in memory when import is slower
+    queue = threading.BoundedSemaphore(2 * (args.fetch_jobs + args.import_jobs))
+
+    fetch_pool = ThreadPoolExecutor(max_workers=args.fetch_jobs)
+    import_pool = ThreadPoolExecutor(max_workers=args.import_jobs)
+
+    for participant in participants:
+        queue.acquire()
+        fetch_pool.submit(fetch_score, participant)
+
+    fetch_pool.shutdown(wait=True)
+    import_pool.shutdown(wait=True)
+
+mapping.close()
+progress.print()
+
+if failures:
+    print()
+    print("Failed participants:")
+    for participant, error in failures:
+        print("  - {} (#{}): {}".format(participant[1], participant[0], error))
+
+    sys.exit(-1)
@@ -1,6 +1,12 @@
 import csv
 import os
+import sys
+import hashlib
 import argparse
+import asyncio
+import threading
+import collections
+import concurrent.futures
 
 import eolymp.universe
 import eolymp.community
@@ -8,41 +14,120 @@ import eolymp.cognito
 import eolymp.wellknown
 import eolymp.core
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import common.aio
+import common.client
+
 
 parser = argparse.ArgumentParser(
     prog='import-members',
     description='Import members from a CSV table',
     epilog='See more at https://github.com/eolymp/scripts/blob/main/import-members/README.md')
 
+parser.add_argument('--force', action='store_true',
+                    help="Update every existing member listed in the file, even if nothing has changed (use it to reset passwords)")
+parser.add_argument('-j', '--jobs', type=int, default=8, help="Number of members created or updated concurrently (default: 8)")
+parser.add_argument('--rejects', metavar="PATH", help="Path to the CSV file with failed rows (default: <input>.rejects.csv)")
+common.client.add_arguments(parser)
+common.aio.add_arguments(parser)
 parser.add_argument('space_key', help="Space Key")
 parser.add_argument('input', help="CSV table with members")
 
 args = parser.parse_args()
 
-client = eolymp.core.HttpClient(token=os.getenv("EOLYMP_TOKEN"))
+if args.jobs < 1:
+    parser.error("number of jobs must be at least 1")
+
+client = common.client.from_args(parser, args, args.jobs)
+async_client = common.aio.from_args(parser, args, args.jobs) if args.use_async else None
 space_svc = eolymp.universe.SpaceServiceClient(client)
 user_svc = eolymp.cognito.UserServiceClient(client)
-lookup = space_svc.LookupSpace(eolymp.universe.LookupSpaceInput(key=args.space_key))
-member_svc = eolymp.community.MemberServiceClient(client, lookup.space.url)
-attribute_svc = eolymp.community.AttributeServiceClient(client, lookup.space.url)
+space = common.client.lookup_space(space_svc, args.space_key)
+member_svc = eolymp.community.MemberServiceClient(client, space.url)
+attribute_svc = eolymp.community.AttributeServiceClient(client, space.url)
+
+ACCOUNT_FIELDS = ["issuer", "subject", "nickname", "name", "email", "country"]
 
-# load existing members into a map indexed by nickname
-def get_members_map():
+# short stable hash of a value, used to compare members without keeping their profiles in memory
+def digest(value):
+    return int.from_bytes(hashlib.blake2b(repr(value).encode(), digest_size=8).digest(), 'big')
+
+# attribute values indexed by attribute key
+def value_map(values):
     mm = {}
-    offset = 0
+    for value in values:
+        mm[value.attribute_key] = digest((value.number, value.string))
 
-    while True:
-        listing = member_svc.ListMembers(eolymp.community.ListMembersInput(offset=offset, size=100))
-        for item in listing.items:
-            if not item.user:
-                continue
+    return mm
 
-            print("Reading existing member \"{}\" with ID {}".format(item.user.nickname, item.id))
-            mm[item.user.nickname] = item
+# fingerprint of the member fields which can be imported: account fields, unofficial, rating, inactive, groups and
+# attributes, each field is hashed separately, so it's possible to tell which fields have changed
+def fingerprint(member):
+    fp = [digest(getattr(member.user, field)) for field in ACCOUNT_FIELDS]
+    fp += [member.unofficial, member.rating, member.inactive, digest(sorted(member.groups)), value_map(member.attributes)]
 
-        offset += len(listing.items)
-        if offset >= listing.total:
-            break
+    return fp
+
+# fingerprint of the existing member after applying the row
+def merge_fingerprint(fp, member, data):
+    fp = list(fp)
+    new = fingerprint(member)
+
+    for i, field in enumerate(ACCOUNT_FIELDS):
+        if getattr(member.user, field):
+            fp[i] = new[i]
+
+    for i, column in [(6, "unofficial"), (7, "rating"), (8, "inactive"), (9, "groups")]:
+        if column in data:
+            fp[i] = new[i]
+
+    fp[10] = dict(fp[10], **new[10])
+
+    return fp
+
+# key the row is matched with an existing member by: ("nickname", nickname) or, for accounts of an identity provider
+# without nickname, ("subject", issuer, subject), members without nickname and subject (ghosts) can not be matched
+def member_key(user):
+    if user.nickname:
+        return "nickname", user.nickname
+
+    if user.subject:
+        return "subject", user.issuer, user.subject
+
+    return None
+
+# member key as it's shown in the output
+def key_label(key):
+    return " ".join(key[1:])
+
+# look up members by their keys, nicknames and subjects are requested in batches, returns key -> (member ID,
+# fingerprint), members which were not found are missing in the result
+def find_members(keys, batch=50):
+    mm = {}
+    keys = set(keys)
+    nicknames = [key[1] for key in keys if key[0] == "nickname"]
+    subjects = [key[2] for key in keys if key[0] == "subject"]
+
+    for field, values in [("user_nickname", nicknames), ("user_subject", subjects)]:
+        for i in range(0, len(values), batch):
+            filters = []
+            for value in values[i:i + batch]:
+                expr = eolymp.wellknown.ExpressionString(value=value)
+                setattr(expr, 'is', eolymp.wellknown.ExpressionString.EQUAL)
+                filters.append(expr)
+
+            listing = member_svc.ListMembers(eolymp.community.ListMembersInput(size=100, filters=eolymp.community.ListMembersInput.Filter(
+                **{field: filters}
+            )))
+
+            for item in listing.items:
+                if field == "user_nickname":
+                    key = ("nickname", item.user.nickname)
+                else:
+                    key = ("subject", item.user.issuer, item.user.subject)
+
+                if key in keys:
+                    mm[key] = (item.id, fingerprint(item))
 
     return mm
 
@@ -63,21 +148,45 @@ def get_attribute_map():
 
     return mm
 
-# resolve Eolymp username to ID
-def resolve_username(username):
-    expr = eolymp.wellknown.ExpressionString(value=username)
-    setattr(expr, 'is', eolymp.wellknown.ExpressionString.EQUAL)
+# resolve Eolymp usernames to accounts, usernames are requested in batches, usernames which do not exist are
+# mapped to None
+def resolve_usernames(usernames, batch=50):
+    accounts = {}
+    usernames = list(usernames)
 
-    out = user_svc.ListUsers(eolymp.cognito.ListUsersInput(filters=eolymp.cognito.ListUsersInput.Filter(
-        username=[expr]
-    )))
+    for i in range(0, len(usernames), batch):
+        chunk = usernames[i:i + batch]
 
-    if len(out.items) == 0:
-        raise Exception("Eolymp user with username \"{}\" does not exist".format(username))
+        filters = []
+        for username in chunk:
+            expr = eolymp.wellknown.ExpressionString(value=username)
+            setattr(expr, 'is', eolymp.wellknown.ExpressionString.EQUAL)
+            filters.append(expr)
 
-    print("Username \"{}\" resolved to ID {}".format(username, out.items[0].id))
+        out = user_svc.ListUsers(eolymp.cognito.ListUsersInput(size=len(chunk), filters=eolymp.cognito.ListUsersInput.Filter(
+            username=filters
+        )))
 
-    return out.items[0]
+        found = {}
+        for item in out.items:
+            found[item.username.lower()] = item
+
+        for username in chunk:
+            accounts[username] = found.get(username.lower())
+            if accounts[username]:
+                print("Username \"{}\" resolved to ID {}".format(username, accounts[username].id))
+
+    return accounts
+
+# resolve Eolymp username to account using usernames resolved in advance
+def resolve_username(username):
+    if username not in usernames:
+        usernames.update(resolve_usernames([username]))
+
+    if not usernames[username]:
+        raise Exception("Eolymp user with username \"{}\" does not exist".format(username))
+
+    return usernames[username]
 
 def to_bool(value):
     return value.lower() in ["true", "1", "yes"]
@@ -102,7 +211,7 @@ def to_values(attributes, row):
 def to_user(row):
     if "password" in row and row["password"]:
         return eolymp.community.User(
-            issuer=lookup.space.issuer_url,
+            issuer=space.issuer_url,
             nickname=row["nickname"] if "nickname" in row else "",
             password=row["password"] if "password" in row else "",
             name=row["name"] if "name" in row else "",
@@ -120,7 +229,7 @@ def to_user(row):
     if "eolymp_username" in row and row["eolymp_username"]:
         acc = resolve_username(row["eolymp_username"])
         return eolymp.community.User(
-            issuer=lookup.space.issuer_url,
+            issuer=space.issuer_url,
             subject=acc.id,
             nickname=acc.username,
             name=acc.name,
@@ -128,6 +237,78 @@ def to_user(row):
 
     return None
 
+# compare member composed from the row with the existing one, returns list of changed fields to patch
+def member_patch(ex, member, data):
+    patch = []
+    current = ex[1]
+    new = fingerprint(member)
+
+    # passwords can not be read back, so a changed password alone does not make the account different
+    for i, field in enumerate(ACCOUNT_FIELDS):
+        if getattr(member.user, field) and new[i] != current[i]:
+            patch.append(eolymp.community.UpdateMemberInput.ACCOUNT)
+            break
+
+    if "unofficial" in data and new[6] != current[6]:
+        patch.append(eolymp.community.UpdateMemberInput.UNOFFICIAL)
+
+    if "rating" in data and new[7] != current[7]:
+        patch.append(eolymp.community.UpdateMemberInput.RATING)
+
+    if "inactive" in data and new[8] != current[8]:
+        patch.append(eolymp.community.UpdateMemberInput.INACTIVE)
+
+    if "groups" in data and new[9] != current[9]:
+        patch.append(eolymp.community.UpdateMemberInput.GROUPS)
+
+    for key, value in new[10].items():
+        if current[10].get(key) != value:
+            patch.append(eolymp.community.UpdateMemberInput.ATTRIBUTES)
+            break
+
+    return patch
+
+# patch every field provided in the row
+def full_patch(member, data):
+    patch = [eolymp.community.UpdateMemberInput.ACCOUNT]
+
+    if "unofficial" in data:
+        patch.append(eolymp.community.UpdateMemberInput.UNOFFICIAL)
+
+    if "rating" in data:
+        patch.append(eolymp.community.UpdateMemberInput.RATING)
+
+    if "inactive" in data:
+        patch.append(eolymp.community.UpdateMemberInput.INACTIVE)
+
+    if "groups" in data:
+        patch.append(eolymp.community.UpdateMemberInput.GROUPS)
+
+    if member.attributes:
+        patch.append(eolymp.community.UpdateMemberInput.ATTRIBUTES)
+
+    return patch
+
+# read rows applied in the previous run, journal is only valid for the same input file
+def load_journal(path, checksum):
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, encoding='UTF8') as f:
+        if f.readline().strip() != checksum:
+            print("Input file has changed since the previous run, ignoring journal \"{}\"".format(path))
+            return set()
+
+        return set(int(line) for line in f if line.strip())
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
 
 # Open import file
 file = open(args.input)
@@ -137,50 +318,237 @@ header = next(reader)
 print("Load attributes...")
 attributes = get_attribute_map()
 
-print("Load existing members...")
-members = get_members_map()
-
-print("Importing file...")
+# applied rows are recorded in the journal, so the next run after a failure only imports the remaining rows
+checksum = file_checksum(args.input)
+journal_path = args.input + ".journal"
+applied = load_journal(journal_path, checksum)
+if applied:
+    print("Skipping {} rows applied in the previous run".format(len(applied)))
+
+journal = open(journal_path, 'w', encoding='UTF8')
+journal.write(checksum + "\n")
+for line in sorted(applied):
+    journal.write("{}\n".format(line))
+journal.flush()
+
+print("Resolve usernames...")
+pending = set()
 for row in reader:
+    if reader.line_num in applied:
+        continue
+
     data = dict(zip(header, row))
+    if "password" in data and data["password"] or "eolymp_user_id" in data and data["eolymp_user_id"]:
+        continue
+
+    if "eolymp_username" in data and data["eolymp_username"]:
+        pending.add(data["eolymp_username"])
+
+usernames = resolve_usernames(sorted(pending))
 
-    user = to_user(data)
-    if not user:
-        print("User is not specified in the row, skipping")
+# only members listed in the file are looked up, in batches, instead of reading every member of the space
+keys = set()
+
+file.seek(0)
+reader = csv.reader(file)
+next(reader)
+
+for row in reader:
+    if reader.line_num in applied:
         continue
 
-    member = eolymp.community.Member(
-        user=user,
-        inactive=to_bool(data["inactive"]) if "inactive" in data else False,
-        rating=int(data["rating"]) if "rating" in data else 0,
-        groups=data["groups"].split(" ") if "groups" in data else [],
-        unofficial=to_bool(data["unofficial"]) if "unofficial" in data else False,
-        attributes=to_values(attributes, data),
-    )
+    try:
+        user = to_user(dict(zip(header, row)))
+    except Exception:
+        continue  # the row is rejected when it's imported
 
-    if user.nickname in members:
-        ex = members[user.nickname]
-        patch = [eolymp.community.UpdateMemberInput.ACCOUNT]
+    if user and member_key(user):
+        keys.add(member_key(user))
 
-        if "unofficial" in data:
-            patch.append(eolymp.community.UpdateMemberInput.UNOFFICIAL)
+print("Load existing members...")
+members = find_members(sorted(keys))
+print("Found {} of {} members listed in the file".format(len(members), len(keys)))
 
-        if "rating" in data:
-            patch.append(eolymp.community.UpdateMemberInput.RATING)
+file.seek(0)
+reader = csv.reader(file)
+next(reader)
+
+rejects_path = args.rejects or args.input + ".rejects.csv"
+rejects_file = open(rejects_path, 'w', encoding='UTF8', newline='\n')
+rejects = csv.writer(rejects_file)
+rejects.writerow(['line', 'reason'] + header)
+
+lock = threading.Lock()
+summary = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+
+# rows for the same member are applied one at a time, so a repeated row never creates a member twice
+member_locks = collections.defaultdict(threading.Lock)
+
+# output is printed under the lock, so messages of rows applied at the same time are not interleaved
+def reject(line, row, reason):
+    with lock:
+        print("An error occurred while importing row {}: {}".format(line, reason))
+        summary['failed'] += 1
+        rejects.writerow([line, reason] + row)
+        rejects_file.flush()
+
+def complete(line, result, message=None):
+    with lock:
+        if message:
+            print(message)
+
+        summary[result] += 1
+        journal.write("{}\n".format(line))
+        journal.flush()
+
+# existing member of the row (None for a new member) and fields to patch, empty if the member has not changed
+def upsert_action(key, member, data):
+    ex = members.get(key)
+    if ex is None:
+        return None, None
+
+    return ex, full_patch(member, data) if args.force else member_patch(ex, member, data)
+
+def created(line, key, member_id, member):
+    # the same member may be listed in the file again
+    members[key] = (member_id, fingerprint(member))
+
+    complete(line, 'created', "Member {} ({}) has been added".format(member_id, key_label(key)))
+
+def updated(line, key, ex, member, data):
+    members[key] = (ex[0], merge_fingerprint(ex[1], member, data))
+    complete(line, 'updated', "Member {} ({}) has been updated".format(ex[0], key_label(key)))
+
+def upsert(line, row, data, member):
+    key = member_key(member.user)
+
+    try:
+        with member_locks[key]:
+            ex, patch = upsert_action(key, member, data)
+
+            if ex is None:
+                out = member_svc.CreateMember(eolymp.community.CreateMemberInput(member=member))
+                created(line, key, out.member_id, member)
+            elif not patch:
+                complete(line, 'unchanged')
+            else:
+                member_svc.UpdateMember(eolymp.community.UpdateMemberInput(member_id=ex[0], patch=patch, member=member))
+                updated(line, key, ex, member, data)
+
+    except Exception as e:
+        reject(line, row, e)
+
+# asyncio mode: the same as upsert, rows for the same member wait for each other on asyncio locks
+async def upsert_async(line, row, data, member, member_svc_async, locks):
+    key = member_key(member.user)
+
+    try:
+        async with locks[key]:
+            ex, patch = upsert_action(key, member, data)
+
+            if ex is None:
+                out = await member_svc_async.CreateMember(eolymp.community.CreateMemberInput(member=member))
+                created(line, key, out.member_id, member)
+            elif not patch:
+                complete(line, 'unchanged')
+            else:
+                await member_svc_async.UpdateMember(eolymp.community.UpdateMemberInput(member_id=ex[0], patch=patch, member=member))
+                updated(line, key, ex, member, data)
+
+    except Exception as e:
+        reject(line, row, e)
+
+# rows which are not applied yet composed into members, rows which can not be parsed are rejected
+def pending_rows():
+    for row in reader:
+        line = reader.line_num
+        if line in applied:
+            continue
 
-        if "inactive" in data:
-            patch.append(eolymp.community.UpdateMemberInput.INACTIVE)
+        data = dict(zip(header, row))
+
+        try:
+            user = to_user(data)
+            if not user:
+                raise Exception("user is not specified in the row")
+
+            if not member_key(user):
+                raise Exception("nickname is required")
+
+            member = eolymp.community.Member(
+                user=user,
+                inactive=to_bool(data["inactive"]) if "inactive" in data else False,
+                rating=int(data["rating"]) if "rating" in data else 0,
+                groups=[group for group in data["groups"].split(" ") if group] if "groups" in data else [],
+                unofficial=to_bool(data["unofficial"]) if "unofficial" in data else False,
+                attributes=to_values(attributes, data),
+            )
+        except Exception as e:
+            reject(line, row, e)
+            continue
 
-        if "groups" in data:
-            patch.append(eolymp.community.UpdateMemberInput.GROUPS)
+        yield line, row, data, member
 
-        if member.attributes:
-            patch.append(eolymp.community.UpdateMemberInput.ATTRIBUTES)
+# asyncio mode: every row is applied by its own task, at most `jobs` rows at a time
+async def import_rows_async():
+    async with async_client:
+        member_svc_async = eolymp.community.MemberServiceClient(async_client, space.url)
+        locks = collections.defaultdict(asyncio.Lock)
+        slots_async = asyncio.Semaphore(args.jobs)
+        tasks = set()
+
+        def done(task):
+            tasks.discard(task)
+            slots_async.release()
 
-        member_svc.UpdateMember(eolymp.community.UpdateMemberInput(member_id=ex.id, patch=patch, member=member))
+        try:
+            for line, row, data, member in pending_rows():
+                await slots_async.acquire()
 
-        print("Member {} ({}) has been updated".format(ex.id, member.user.nickname))
-    else:
-        out = member_svc.CreateMember(eolymp.community.CreateMemberInput(member=member))
+                task = asyncio.ensure_future(upsert_async(line, row, data, member, member_svc_async, locks))
+                task.add_done_callback(done)
+                tasks.add(task)
 
-        print("Member {} ({}) has been added".format(out.member_id, member.user.nickname))
+            await asyncio.gather(*tasks)
+        finally:
+            # on Ctrl-C wait for cancelled tasks, so nothing is written to the journal after it's closed
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+print("Importing file...")
+if async_client:
+    try:
+        common.aio.run(import_rows_async())
+    except KeyboardInterrupt:
+        journal.close()
+        rejects_file.close()
+
+        print("Interrupted, applied rows are saved to \"{}\", run the script again to continue".format(journal_path))
+        sys.exit(-1)
+else:
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.jobs)
+    slots = threading.BoundedSemaphore(2 * args.jobs)
+
+    for line, row, data, member in pending_rows():
+        slots.acquire()
+        future = executor.submit(upsert, line, row, data, member)
+        future.add_done_callback(lambda f: slots.release())
+
+    executor.shutdown(wait=True)
+
+journal.close()
+rejects_file.close()
+
+print("{} members created, {} updated, {} unchanged, {} failed".format(
+    summary['created'], summary['updated'], summary['unchanged'], summary['failed']))
+
+if summary['failed']:
+    print("Failed rows are saved to \"{}\", fix them or run the script again to retry".format(rejects_path))
+    sys.exit(-1)
+
+# every row has been applied, the next run imports the whole file again
+os.remove(journal_path)
+os.remove(rejects_path)
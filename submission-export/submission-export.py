@@ -3,56 +3,464 @@ import os
 from datetime import datetime
 import sys
 import csv
+import hashlib
+import io
+import shutil
+import tarfile
+import zipfile
+import json
+import time
+import threading
+import concurrent.futures
 import requests
+import requests.adapters
+from google.protobuf import timestamp_pb2
 
 import eolymp.core
 import eolymp.universe
 import eolymp.judge
 import eolymp.wellknown
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import common.cache
+import common.client
+import common.submission
+
 
 def timestamp(ts: int):
     return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
 
 
-def verdict_label(status, verdict):
-    if status == eolymp.atlas.Submission.PENDING:
-        return 'PENDING'
-    if status == eolymp.atlas.Submission.TESTING:
-        return 'TESTING'
-    if status == eolymp.atlas.Submission.TIMEOUT:
-        return 'TIMEOUT'
-    if status == eolymp.atlas.Submission.COMPLETE:
-        if verdict == eolymp.atlas.Submission.ACCEPTED:
-            return 'AC'
-        if verdict == eolymp.atlas.Submission.WRONG_ANSWER:
-            return 'WA'
-        if verdict == eolymp.atlas.Submission.TIME_LIMIT_EXCEEDED:
-            return 'TL'
-        if verdict == eolymp.atlas.Submission.CPU_EXHAUSTED:
-            return 'TL'
-        if verdict == eolymp.atlas.Submission.MEMORY_OVERFLOW:
-            return 'MO'
-        if verdict == eolymp.atlas.Submission.RUNTIME_ERROR:
-            return 'RE'
-        return 'UNKNOWN'
-    if status == eolymp.atlas.Submission.ERROR:
-        return 'CE'
-    if status == eolymp.atlas.Submission.FAILURE:
-        return 'FAILURE'
-
-def download_source(url, path):
-    try:
+# stores sources as individual files under a given directory, with deduplication enabled the content is stored once
+# in <path>/.blobs/<sha256> and every submission path is a hardlink to the blob, <path>/.blobs/urls maps source URLs to
+# blobs, so a source which was downloaded in the previous export is not downloaded again
+class DirectoryStore:
+    def __init__(self, path, dedup=False):
+        self.path = path
+        self.dedup = dedup
+        self.lock = threading.Lock()
+        self.blobs = os.path.join(path, '.blobs')
+        self.urls = {}
+        self.duplicates = 0
+
+        if dedup:
+            os.makedirs(self.blobs, exist_ok=True)
+
+            if os.path.exists(os.path.join(self.blobs, 'urls')):
+                with open(os.path.join(self.blobs, 'urls'), encoding='UTF8') as f:
+                    for line in f:
+                        url, _, digest = line.rstrip('\n').rpartition(' ')
+                        if url:
+                            self.urls[url] = digest
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.path, name))
+
+    # materializes source from a blob downloaded earlier, returns False if the URL has not been seen yet
+    def link(self, name, url):
+        if not self.dedup:
+            return False
+
+        with self.lock:
+            digest = self.urls.get(url)
+
+        if not digest or not os.path.exists(self._blob(digest)):
+            return False
+
+        self._materialize(name, digest)
+
+        return True
+
+    def write(self, name, content, url):
+        if not self.dedup:
+            self._put(os.path.join(self.path, name), content)
+            return
+
+        digest = hashlib.sha256(content).hexdigest()
+        if os.path.exists(self._blob(digest)):
+            with self.lock:
+                self.duplicates += 1
+        else:
+            self._put(self._blob(digest), content)
+
+        self._materialize(name, digest)
+
+        with self.lock:
+            if url not in self.urls:
+                self.urls[url] = digest
+                with open(os.path.join(self.blobs, 'urls'), 'a', encoding='UTF8') as f:
+                    f.write(url + ' ' + digest + '\n')
+
+    def close(self):
+        pass
+
+    def _blob(self, digest):
+        return os.path.join(self.blobs, digest[:2], digest)
+
+    def _materialize(self, name, digest):
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp = path + '.part'
+        if os.path.exists(temp):
+            os.remove(temp)
+
+        try:
+            os.link(self._blob(digest), temp)
+        except OSError:
+            # file system does not support hardlinks
+            shutil.copyfile(self._blob(digest), temp)
+
+        os.replace(temp, path)
+
+    @staticmethod
+    def _put(path, content):
         os.makedirs(os.path.dirname(path), exist_ok=True)
 
-        resp = requests.get(url)
-        resp.raise_for_status()  # Raise an error for bad responses (4xx or 5xx)
+        # write into a temporary file first, so an interrupted export never leaves a truncated source behind,
+        # temporary name is unique per thread since the same blob can be written by two downloads at once
+        temp = "{}.{}.part".format(path, threading.get_ident())
+        with open(temp, 'wb') as f:
+            f.write(content)
+
+        os.replace(temp, path)
+
+
+# streams sources into a single zip, tar, tar.gz or tar.zst archive, entries are appended as soon as they are
+# downloaded, tar archives are written in stream mode and entries are not kept after they are written, so memory
+# usage does not grow with the number of sources (except the hash of every unique source with deduplication), zip
+# archives keep an entry per source in memory for the central directory written at the end, with deduplication
+# enabled repeated content is added to tar archives as a hardlink to the first entry
+class ArchiveStore:
+    def __init__(self, path, dedup=False):
+        self.path = path
+        self.dedup = dedup
+        self.lock = threading.Lock()
+        self.zip = None
+        self.tar = None
+        self.compressor = None
+        self.entries = {}
+        self.urls = {}
+        self.duplicates = 0
+
+        if path.endswith('.zip'):
+            self.zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+        elif path.endswith('.tar.zst') or path.endswith('.tzst'):
+            try:
+                import zstandard
+            except ImportError:
+                raise Exception("zstd compression requires zstandard package, install it using \"pip install zstandard\"")
+
+            self.compressor = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+            self.tar = tarfile.open(fileobj=self.compressor, mode='w|')
+        elif path.endswith('.tar.gz') or path.endswith('.tgz'):
+            self.tar = tarfile.open(path, mode='w|gz')
+        elif path.endswith('.tar'):
+            self.tar = tarfile.open(path, mode='w|')
+        else:
+            raise Exception("unsupported archive type, use .zip, .tar, .tar.gz or .tar.zst extension")
+
+    @staticmethod
+    def supports(path):
+        return path.endswith(('.zip', '.tar', '.tar.gz', '.tgz', '.tar.zst', '.tzst'))
+
+    def exists(self, name):
+        return False
+
+    def link(self, name, url):
+        if not self.dedup or not self.tar:
+            return False
+
+        with self.lock:
+            digest = self.urls.get(url)
+            if not digest:
+                return False
+
+            self._add_link(name, digest)
+
+        return True
+
+    def write(self, name, content, url):
+        with self.lock:
+            if self.zip:
+                self.zip.writestr(name, content)
+                return
+
+            if self.dedup:
+                digest = hashlib.sha256(content).hexdigest()
+                self.urls.setdefault(url, digest)
+
+                if digest in self.entries:
+                    self._add_link(name, digest)
+                    self.duplicates += 1
+                    return
+
+                self.entries[digest] = name
+
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = int(time.time())
+            self.tar.addfile(info, io.BytesIO(content))
+
+            # tarfile keeps every written entry even in stream mode, they are not needed once written
+            self.tar.members.clear()
+
+    def close(self):
+        if self.zip:
+            self.zip.close()
+
+        if self.tar:
+            self.tar.close()
+
+        if self.compressor:
+            self.compressor.close()
+
+    def _add_link(self, name, digest):
+        info = tarfile.TarInfo(name)
+        info.type = tarfile.LNKTYPE
+        info.linkname = self.entries[digest]
+        info.mtime = int(time.time())
+        self.tar.addfile(info)
+        self.tar.members.clear()
+
+
+# downloads sources in background threads sharing a single keep-alive session, at most `jobs` downloads run at the
+# same time and at most `2 * jobs` are queued, so paging through submissions blocks instead of piling up memory,
+# failed downloads are retried by the API client, so a stalled connection times out instead of blocking the export
+class DownloadPool:
+    def __init__(self, jobs, store, client):
+        self.store = store
+        self.client = client
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        self.slots = threading.BoundedSemaphore(2 * jobs)
+        self.lock = threading.Lock()
+        self.failures = []
+        self.downloaded = {}
+        self.queued = set()
+        self.count = 0
+        self.skipped = 0
+
+    def submit(self, submission_id, url, name):
+        # incremental export may list the same submission twice in a single run
+        if submission_id in self.queued:
+            return
+
+        self.queued.add(submission_id)
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self._download, submission_id, url, name)
+        except Exception:
+            self.slots.release()
+            raise
+
+        future.add_done_callback(lambda f: self.slots.release())
+
+    def _download(self, submission_id, url, name):
+        try:
+            if self.store.link(name, url):
+                with self.lock:
+                    self.skipped += 1
+                    self.downloaded[submission_id] = name
+                return
+
+            self.store.write(name, self.client.download(url, self.session), url)
+            with self.lock:
+                self.count += 1
+                self.downloaded[submission_id] = name
+        except Exception as e:
+            print("  ERROR: Failed to download source for submission #{}: {}".format(submission_id, e))
+            with self.lock:
+                self.failures.append((submission_id, url, str(e)))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+        self.store.close()
+
+    # returns sources downloaded since the previous call
+    def collect(self):
+        with self.lock:
+            downloaded = self.downloaded
+            self.downloaded = {}
+
+        return downloaded
+
+
+# resolves participant display names on demand, only participants referenced by exported submissions are requested,
+# unknown IDs are requested in batches using ID filter, names are cached including participants which were not found
+class ParticipantNames:
+    batch = 50
+
+    def __init__(self, judge, contest_id):
+        self.judge = judge
+        self.contest_id = contest_id
+        self.prefix = common.client.contest_key(judge, contest_id) + "/names/"
+        self.names = {}
+
+    # names are cached one entry per participant, so every page only stores participants it has requested
+    def resolve(self, ids):
+        missing = [pid for pid in set(ids) if pid not in self.names]
+        if not missing:
+            return
+
+        cached = common.cache.get_many("participants", [self.prefix + pid for pid in missing])
+        for key, name in cached.items():
+            self.names[key[len(self.prefix):]] = name
+
+        missing = [pid for pid in missing if pid not in self.names]
+
+        for i in range(0, len(missing), self.batch):
+            batch = missing[i:i + self.batch]
+
+            matches = []
+            for pid in batch:
+                exp = eolymp.wellknown.ExpressionID(value=pid)
+                setattr(exp, "is", eolymp.wellknown.ExpressionID.EQUAL)
+                matches.append(exp)
+
+            out = self.judge.ListParticipants(eolymp.judge.ListParticipantsInput(
+                contest_id=self.contest_id,
+                size=len(batch),
+                filters=eolymp.judge.ListParticipantsInput.Filter(id=matches),
+            ))
+
+            names = {pid: None for pid in batch}
+            for item in out.items:
+                names[item.id] = item.display_name
+
+            self.names.update(names)
+            common.cache.put_many("participants", {self.prefix + pid: name for pid, name in names.items()})
+
+    # returns display name, or participant ID if participant does not exist
+    def get(self, pid):
+        return self.names.get(pid) or pid
+
+
+HEADER = ['id', 'participant', 'problem', 'submit_time', 'status', 'score']
+
+# JSONL and Parquet outputs carry the CSV columns and raw submission fields
+FIELDS = HEADER + ['participant_id', 'problem_id', 'problem_index', 'submitted_at', 'raw_status', 'raw_verdict', 'lang']
+
+# submissions in these statuses may still change, incremental export re-reads them on every run
+UNSETTLED = ['PENDING', 'TESTING']
+
+
+def enum_name(enum, value):
+    try:
+        return enum.Name(value)
+    except ValueError:
+        return str(value)
+
+
+# writes records as a CSV table, only the columns listed in HEADER are written
+class CsvOutput:
+    def __init__(self, file):
+        self.writer = csv.writer(file)
+
+    def header(self):
+        self.writer.writerow(HEADER)
+
+    def write(self, record):
+        self.writer.writerow([record[column] for column in HEADER])
+
+
+# writes each record as a JSON object on a separate line
+class JsonlOutput:
+    def __init__(self, file):
+        self.file = file
+
+    def header(self):
+        pass
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+# writes records into a Parquet file with typed columns, records are buffered and written in row groups
+class ParquetOutput:
+    def __init__(self, path, row_group_size):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception("Parquet output requires pyarrow package, install it using \"pip install pyarrow\"")
+
+        label = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            ('id', pyarrow.string()),
+            ('participant', pyarrow.string()),
+            ('problem', label),
+            ('submit_time', pyarrow.string()),
+            ('status', label),
+            ('score', pyarrow.float64()),
+            ('participant_id', pyarrow.string()),
+            ('problem_id', label),
+            ('problem_index', pyarrow.int32()),
+            ('submitted_at', pyarrow.timestamp('s', tz='UTC')),
+            ('raw_status', label),
+            ('raw_verdict', label),
+            ('lang', label),
+        ])
+
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        self.row_group_size = row_group_size
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+        if len(self.records) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+
+        self.writer.write_table(self.pyarrow.Table.from_pylist(self.records, schema=self.schema))
+        self.records = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+OUTPUTS = {'csv': CsvOutput, 'jsonl': JsonlOutput}
+
+
+def write_records(path, records, output):
+    with open(path + '.part', 'w', encoding='UTF8', newline='\n') as f:
+        writer = output(f)
+        writer.header()
+        for record in records:
+            writer.write(record)
+
+        size = f.tell()
 
-        with open(path, 'wb') as f:
-            f.write(resp.content)
+    os.replace(path + '.part', path)
+
+    return size
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding='UTF8') as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    with open(path + '.part', 'w', encoding='UTF8') as f:
+        json.dump(manifest, f)
+
+    os.replace(path + '.part', path)
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error downloading the file: {e}")
 
 def runtime_ext(runtime):
     lang = runtime.split(':')[0]
@@ -81,28 +489,56 @@ def runtime_ext(runtime):
 
 parser = argparse.ArgumentParser(
     prog='submission-export',
-    description='Export contest submissions in a CSV table',
+    description='Export contest submissions in a CSV, JSONL or Parquet table',
     epilog='See more at https://github.com/eolymp/scripts/blob/main/submission-export/README.md')
 
-parser.add_argument('-x', '--source', help="Download source files to a given path", dest='source')
+parser.add_argument('-x', '--source', dest='source',
+                    help="Download source files to a given path, use path with .zip, .tar, .tar.gz or .tar.zst extension to write sources into a single archive")
+parser.add_argument('-f', '--format', choices=['csv', 'jsonl', 'parquet'], default='csv',
+                    help="Output format: 'csv' (default), 'jsonl' or 'parquet'")
+parser.add_argument('--row-group-size', type=int, default=50000,
+                    help="Number of submissions in a single Parquet row group (default: 50000)")
+parser.add_argument('-i', '--incremental', action='store_true',
+                    help="Only export submissions which are new or changed since the previous run, keeps track of exported submissions in <output>.manifest.json")
+parser.add_argument('--dedup', action='store_true',
+                    help="Store identical source files once, sources are hardlinked to a content-addressed blob (tar archives store a hardlink entry)")
+parser.add_argument('-j', '--jobs', type=int, default=8, help="Number of source files downloaded concurrently (default: 8)")
+parser.add_argument('--page-size', type=int, default=100, help="Number of submissions requested at once (default: 100)")
+parser.add_argument('--prefetch', type=int, default=4, help="Number of submission pages requested in parallel (default: 4)")
 parser.add_argument('-p', metavar="PROBLEM-ID", help="Only export submissions for a given problem")
 parser.add_argument('-u', metavar="PARTICIPANT-ID", help="Only export submissions for a given participant")
 parser.add_argument('-s', metavar="STATUS",
                     help="Only export submissions in a given status: 'PENDING', 'TESTING', 'TIMEOUT', 'ERROR', 'FAILURE', 'COMPLETE'",
                     choices=['PENDING', 'TESTING', 'TIMEOUT', 'ERROR', 'FAILURE', 'COMPLETE'])
 
+common.client.add_arguments(parser)
 parser.add_argument('space_key', help="Space Key")
 parser.add_argument('contest_id', help="Contest ID")
 parser.add_argument('output', help="Output file")
 
 args = parser.parse_args()
-client = eolymp.core.HttpClient(token=os.getenv("EOLYMP_TOKEN"))
+
+if args.jobs < 1:
+    parser.error("number of jobs must be at least 1")
+
+if args.page_size < 1 or args.prefetch < 1:
+    parser.error("page size and number of prefetched pages must be at least 1")
+
+if args.incremental and args.format == 'parquet':
+    parser.error("incremental export can not append to a Parquet file, use CSV or JSONL format instead")
+
+if args.row_group_size < 1:
+    parser.error("row group size must be at least 1")
+
+if args.source and args.incremental and ArchiveStore.supports(args.source):
+    parser.error("incremental export can not add sources to an existing archive, download sources to a directory instead")
+
+client = common.client.from_args(parser, args, args.prefetch)
 
 # lookup space
 universe = eolymp.universe.SpaceServiceClient(client)
 try:
-    out = universe.LookupSpace(eolymp.universe.LookupSpaceInput(key=args.space_key))
-    space = out.space
+    space = common.client.lookup_space(universe, args.space_key)
     print("Found space \"{}\"".format(space.name))
 except Exception as e:
     print("An error occurred while loading space with key \"{}\": {}".format(args.space_key, e))
@@ -113,13 +549,11 @@ judge = eolymp.judge.JudgeClient(client, space.url)
 # lookup contest
 problems = {}
 try:
-    out = judge.DescribeContest(eolymp.judge.DescribeContestInput(contest_id=args.contest_id))
-    contest = out.contest
+    contest = common.client.describe_contest(judge, args.contest_id)
     print("Found contest \"{}\"".format(contest.name))
 
-    out = judge.ListProblems(eolymp.judge.ListProblemsInput(contest_id=args.contest_id))
     index = 0
-    for item in out.items:
+    for item in common.client.list_problems(judge, args.contest_id):
         print("  - Found problem #{}".format(item.id))
         index = index+1
         item.index = index
@@ -129,24 +563,8 @@ except Exception as e:
     print("An error occurred while loading contest with ID \"{}\": {}".format(args.contest_id, e))
     sys.exit(-1)
 
-# load participants
-participants = {}
-
-offset = 0
-size = 100
-while True:
-    out = judge.ListParticipants(eolymp.judge.ListParticipantsInput(contest_id=contest.id, size=size, offset=offset))
-    for item in out.items:
-        participants[item.id] = item
-
-    offset += size
-
-    if out.total < offset:
-        break
-
-# open export file
-file = open(args.output, 'w', encoding='UTF8', newline='\n')
-writer = csv.writer(file)
+# participants are loaded as they are referenced by submissions
+participants = ParticipantNames(judge, contest.id)
 
 # compose submission filters
 filters = {}
@@ -165,53 +583,214 @@ if args.u:
     setattr(exp, "is", eolymp.wellknown.ExpressionID.EQUAL)
     filters['participant_id'] = [exp]
 
-# write header row
-writer.writerow(['id', 'participant', 'problem', 'submit_time', 'status', 'score'])
+# load manifest from the previous run
+manifest = None
+manifest_path = args.output + ".manifest.json"
+
+if args.incremental:
+    options = {'contest_id': args.contest_id, 'format': args.format, 'p': args.p, 'u': args.u, 's': args.s}
+    manifest = load_manifest(manifest_path)
+
+    if manifest and manifest['options'] != options:
+        labels = {'contest_id': "contest ID", 'format': "-f"}
+        different = [labels.get(key, "-" + key) for key in options if manifest['options'].get(key) != options[key]]
+        print("Manifest \"{}\" was created with different arguments ({}), remove it to start a new export".format(
+            manifest_path, ", ".join(different)))
+        sys.exit(-1)
+
+    if not manifest:
+        manifest = {'options': options, 'watermark': None, 'size': 0, 'rows': {}, 'sources': {}, 'rewrite': False}
+    else:
+        print("Found manifest with {} exported submissions".format(len(manifest['rows'])))
+
+# open export file, in incremental mode rows written after the last checkpoint are discarded, they will be exported again
+file = None
+if args.format == 'parquet':
+    try:
+        writer = ParquetOutput(args.output, args.row_group_size)
+    except Exception as e:
+        print("An error occurred while opening output file \"{}\": {}".format(args.output, e))
+        sys.exit(-1)
+
+elif manifest and manifest['rows']:
+    if not os.path.exists(args.output) or os.path.getsize(args.output) < manifest['size']:
+        manifest['size'] = write_records(args.output, manifest['rows'].values(), OUTPUTS[args.format])
+
+    file = open(args.output, 'r+', encoding='UTF8', newline='\n')
+    file.truncate(manifest['size'])
+    file.seek(manifest['size'])
+    writer = OUTPUTS[args.format](file)
+else:
+    file = open(args.output, 'w', encoding='UTF8', newline='\n')
+    writer = OUTPUTS[args.format](file)
+
+    # write header row
+    writer.header()
+
+# start source downloader
+downloader = None
+if args.source:
+    try:
+        if ArchiveStore.supports(args.source):
+            store = ArchiveStore(args.source, args.dedup)
+        else:
+            store = DirectoryStore(args.source, args.dedup)
+    except Exception as e:
+        print("An error occurred while opening source archive \"{}\": {}".format(args.source, e))
+        sys.exit(-1)
+
+    downloader = DownloadPool(args.jobs, store, client)
+
+
+def checkpoint():
+    file.flush()
+    manifest['size'] = file.tell()
+
+    if downloader:
+        manifest['sources'].update(downloader.collect())
+
+    save_manifest(manifest_path, manifest)
+
+
+def list_submissions(query):
+    def fetch(offset, size):
+        return judge.ListSubmissions(eolymp.judge.ListSubmissionsInput(
+            size=size,
+            offset=offset,
+            contest_id=args.contest_id,
+            filters=eolymp.judge.ListSubmissionsInput.Filter(**query),
+            extra=[eolymp.judge.Submission.SOURCE]
+        ))
+
+    return common.client.paginate(fetch, args.page_size, args.prefetch)
+
+
+def to_record(item):
+    problem = problems.get(item.problem_id)
+
+    return {
+        'id': item.id,
+        'participant': participants.get(item.participant_id),
+        'problem': chr(ord('A') + problem.index - 1) if problem else '?',
+        'submit_time': timestamp(item.submitted_at.seconds),
+        'status': common.submission.verdict_label(item.status, item.verdict),
+        'score': item.score,
+        'participant_id': item.participant_id,
+        'problem_id': item.problem_id,
+        'problem_index': problem.index if problem else None,
+        'submitted_at': item.submitted_at.seconds,
+        'raw_status': enum_name(eolymp.atlas.Submission.Status, item.status),
+        'raw_verdict': enum_name(eolymp.atlas.Submission.Verdict, item.verdict),
+        'lang': item.lang,
+    }
+
+
+# compose listing queries, incremental export only lists submissions sent since the last complete run and
+# re-reads submissions which were not judged yet
+queries = [filters]
+if manifest and manifest['watermark'] is not None:
+    exp = eolymp.wellknown.ExpressionTimestamp(value=timestamp_pb2.Timestamp(seconds=manifest['watermark']))
+    setattr(exp, "is", eolymp.wellknown.ExpressionTimestamp.GREATER_THAN_EQUAL)
+    queries = [dict(filters, submitted_at=[exp])]
+
+    unsettled = [sid for sid, record in manifest['rows'].items() if record['status'] in UNSETTLED]
+    for i in range(0, len(unsettled), args.page_size):
+        ids = []
+        for sid in unsettled[i:i + args.page_size]:
+            exp = eolymp.wellknown.ExpressionID(value=sid)
+            setattr(exp, "is", eolymp.wellknown.ExpressionID.EQUAL)
+            ids.append(exp)
+
+        queries.append(dict(filters, id=ids))
 
 # export submissions
 count = 0
-offset = 0
-size = 25
-
-while True:
-    out = judge.ListSubmissions(eolymp.judge.ListSubmissionsInput(
-        size=size,
-        offset=offset,
-        contest_id=args.contest_id,
-        filters=eolymp.judge.ListSubmissionsInput.Filter(**filters),
-        extra=[eolymp.judge.Submission.SOURCE]
-    ))
-
-    count += len(out.items)
-
-    for item in out.items:
-        print(
-            "  Exporting submission #{}: problem {}, participant {}, status {}, score: {}".
-            format(item.id, item.problem_id, item.participant_id, item.status, item.score)
-        )
-
-        letter = chr(ord('A') + problems[item.problem_id].index - 1) if item.problem_id in problems else '?'
-
-        writer.writerow([
-            item.id,
-            participants[item.participant_id].display_name if item.participant_id in participants else item.participant_id,
-            letter,
-            timestamp(item.submitted_at.seconds),
-            verdict_label(item.status, item.verdict),
-            item.score,
-        ])
+watermark = manifest['watermark'] if manifest else None
+last_checkpoint = time.monotonic()
+
+for query in queries:
+    for items in list_submissions(query):
+        participants.resolve([item.participant_id for item in items])
+
+        for item in items:
+            record = to_record(item)
+
+            if manifest:
+                watermark = max(watermark or 0, item.submitted_at.seconds)
+
+            if not manifest or item.id not in manifest['rows']:
+                print(
+                    "  Exporting submission #{}: problem {}, participant {}, status {}, score: {}".
+                    format(item.id, item.problem_id, item.participant_id, item.status, item.score)
+                )
+
+                writer.write(record)
+                if manifest:
+                    manifest['rows'][item.id] = record
+
+                count += 1
+
+            elif manifest['rows'][item.id] != record:
+                print(
+                    "  Updating submission #{}: problem {}, participant {}, status {}, score: {}".
+                    format(item.id, item.problem_id, item.participant_id, item.status, item.score)
+                )
 
-        if args.source:
-            dest = args.source + "/" + participants[item.participant_id].display_name + "/" + letter +"_" + item.id + "." + runtime_ext(item.lang)
-            print("  Downloading source {} to {}".format(item.source_url, dest))
-            download_source(item.source_url, dest)
+                # the row is rewritten at the end of the run, the flag is saved with the checkpoint so an interrupted
+                # run still rewrites the table when it's resumed
+                manifest['rows'][item.id] = record
+                manifest['rewrite'] = True
+                count += 1
 
+            if args.source:
+                name = record['participant'] + "/" + record['problem'] +"_" + item.id + "." + runtime_ext(item.lang)
+                if manifest and manifest['sources'].get(item.id) == name and downloader.store.exists(name):
+                    continue
 
-    offset += size
+                print("  Downloading source {} to {}".format(item.source_url, args.source + "/" + name))
+                downloader.submit(item.id, item.source_url, name)
 
-    if out.total < offset:
-        break
+        if manifest and time.monotonic() - last_checkpoint > 5:
+            checkpoint()
+            last_checkpoint = time.monotonic()
 
-file.close()
+if manifest:
+    file.flush()
+    manifest['size'] = file.tell()
+
+if file:
+    file.close()
+else:
+    writer.close()
+
+if downloader:
+    print("Waiting for source downloads to finish...")
+    downloader.close()
+
+# rows with changed status are replaced in place by rewriting the table once, all the other rows were appended
+if manifest:
+    if manifest.get('rewrite'):
+        manifest['size'] = write_records(args.output, manifest['rows'].values(), OUTPUTS[args.format])
+        manifest['rewrite'] = False
+
+    if downloader:
+        manifest['sources'].update(downloader.collect())
+
+    # the listing is complete, next run only needs submissions sent after this point
+    manifest['watermark'] = watermark
+    save_manifest(manifest_path, manifest)
 
 print("{} submissions has been exported to {}".format(count, args.output))
+
+if downloader:
+    print("{} source files has been downloaded to {}".format(downloader.count, args.source))
+
+    if args.dedup:
+        print("{} source files were identical to already stored ones, {} of them were not downloaded".format(
+            downloader.store.duplicates + downloader.skipped, downloader.skipped))
+
+    if downloader.failures:
+        print("Failed to download {} source files:".format(len(downloader.failures)))
+        for submission_id, url, error in downloader.failures:
+            print("  - Submission #{} ({}): {}".format(submission_id, url, error))
+        sys.exit(-1)
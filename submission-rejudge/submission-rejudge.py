@@ -1,35 +1,174 @@
 import argparse
+import asyncio
+import json
 import os
 import sys
 import time
+from datetime import datetime
+from google.protobuf import timestamp_pb2
 
 import eolymp.wellknown
 import eolymp.core
 import eolymp.universe
 import eolymp.judge
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import common.aio
+import common.client
+import common.submission
+
+
+# PENDING and TESTING submissions in the contest, only the total is requested
+def judge_queue_input(contest_id):
+    status = []
+    for value in ['PENDING', 'TESTING']:
+        exp = eolymp.wellknown.ExpressionEnum(value=value)
+        setattr(exp, "is", eolymp.wellknown.ExpressionEnum.EQUAL)
+        status.append(exp)
+
+    return eolymp.judge.ListSubmissionsInput(
+        size=1,
+        contest_id=contest_id,
+        filters=eolymp.judge.ListSubmissionsInput.Filter(status=status)
+    )
+
+
+# keeps the number of submissions waiting for the judge close to the target: the number of PENDING and TESTING
+# submissions in the contest is polled every `interval` seconds and only the difference to the target is dispatched
+# until the next poll, failed requests slow dispatching down with exponential backoff
+class Throttle:
+    def __init__(self, judge, contest_id, target, interval):
+        self.judge = judge
+        self.contest_id = contest_id
+        self.target = target
+        self.interval = interval
+        self.budget = 0
+        self.polled = None
+        self.backoff = 0
+
+    def queued(self):
+        return self.judge.ListSubmissions(judge_queue_input(self.contest_id)).total
+
+    # blocks until another submission can be sent to the judge
+    def acquire(self):
+        while self.budget <= 0:
+            if self.polled is not None:
+                time.sleep(max(0.0, self.interval - (time.monotonic() - self.polled)))
+
+            try:
+                queued = self.queued()
+            except Exception as e:
+                print("  ERROR: Unable to read judge queue: {}".format(e))
+                self.failure()
+                continue
+
+            self.polled = time.monotonic()
+            self.budget = self.target - queued
+
+            print("  Judge queue: {} submissions, dispatching {} more".format(queued, max(0, self.budget)))
+
+        self.budget -= 1
+
+    def success(self):
+        self.backoff = 0
+
+    def failure(self):
+        self.backoff = min(max(1, self.backoff * 2), 60)
+        time.sleep(self.backoff)
+
+
+def duration(seconds):
+    seconds = int(seconds)
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def to_list(value):
+    return [v for v in value.split(',') if v]
+
+
+def to_time(value):
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid time \"{}\", use YYYY-MM-DD or YYYY-MM-DD HH:MM:SS format".format(value))
+
+
+def load_plan(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding='UTF8') as f:
+        return json.load(f)
+
+
+def save_plan(path, plan):
+    with open(path + '.part', 'w', encoding='UTF8') as f:
+        json.dump(plan, f)
+
+    os.replace(path + '.part', path)
+
+
+# reads IDs of submissions retested in the previous run, the journal is appended after every retest
+def load_journal(path):
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, encoding='UTF8') as f:
+        return set(line.strip() for line in f if line.strip())
+
+
 parser = argparse.ArgumentParser(
     prog='submission-rejudge',
     description='Trigger rejudge on the contest submissions',
     epilog='See more at https://github.com/eolymp/scripts/blob/main/submission-rejudge/README.md')
 
-parser.add_argument('-p', metavar="PROBLEM-ID", help="Only rejudge submissions for a given problem")
-parser.add_argument('-u', metavar="PARTICIPANT-ID", help="Only rejudge submissions for a given participant")
-parser.add_argument('-s', metavar="STATUS",
-                    help="Only rejudge submissions in a given status: 'PENDING', 'TESTING', 'TIMEOUT', 'ERROR', 'FAILURE', 'COMPLETE'",
-                    choices=['PENDING', 'TESTING', 'TIMEOUT', 'ERROR', 'FAILURE', 'COMPLETE'])
+parser.add_argument('--page-size', type=int, default=100, help="Number of submissions requested at once (default: 100)")
+parser.add_argument('--prefetch', type=int, default=4, help="Number of submission pages requested in parallel (default: 4)")
+parser.add_argument('--target', type=int, default=20,
+                    help="Number of PENDING and TESTING submissions to keep in the contest while rejudging (default: 20)")
+parser.add_argument('--interval', type=float, default=5,
+                    help="Number of seconds between checks of the judge queue (default: 5)")
+parser.add_argument('--plan', metavar="PATH",
+                    help="Path to the rejudge plan, a list of submissions selected for rejudge (default: rejudge-<contest-id>.json)")
+parser.add_argument('-w', '--wait', action='store_true',
+                    help="Wait for rejudge to finish, report progress and show changes in verdicts and scores")
+parser.add_argument('-p', metavar="PROBLEM-ID", action='extend', type=to_list, default=[],
+                    help="Only rejudge submissions for given problems, repeat or separate IDs with comma to select several problems")
+parser.add_argument('-u', metavar="PARTICIPANT-ID", action='extend', type=to_list, default=[],
+                    help="Only rejudge submissions for given participants, repeat or separate IDs with comma to select several participants")
+parser.add_argument('-s', metavar="STATUS", action='extend', type=to_list, default=[],
+                    help="Only rejudge submissions in given statuses: 'PENDING', 'TESTING', 'TIMEOUT', 'ERROR', 'FAILURE', 'COMPLETE', repeat or separate statuses with comma to select several statuses")
+parser.add_argument('--after', metavar="TIME", type=to_time,
+                    help="Only rejudge submissions sent at or after a given time, for example '2024-03-01 10:00:00'")
+parser.add_argument('--before', metavar="TIME", type=to_time,
+                    help="Only rejudge submissions sent before a given time")
+parser.add_argument('--latest', action='store_true',
+                    help="Only rejudge submissions which are the latest submission of the participant for the problem")
 
+common.client.add_arguments(parser)
+common.aio.add_arguments(parser)
 parser.add_argument('space_key', help="Space Key")
 parser.add_argument('contest_id', help="Contest ID")
 
 args = parser.parse_args()
-client = eolymp.core.HttpClient(token=os.getenv("EOLYMP_TOKEN"))
+
+if args.page_size < 1 or args.prefetch < 1:
+    parser.error("page size and number of prefetched pages must be at least 1")
+
+if args.target < 1 or args.interval <= 0:
+    parser.error("target must be at least 1 and interval must be positive")
+
+for status in args.s:
+    if status not in ['PENDING', 'TESTING', 'TIMEOUT', 'ERROR', 'FAILURE', 'COMPLETE']:
+        parser.error("invalid status \"{}\"".format(status))
+
+client = common.client.from_args(parser, args, args.prefetch)
+async_client = common.aio.from_args(parser, args, args.prefetch + args.target) if args.use_async else None
 
 # lookup space
 universe = eolymp.universe.SpaceServiceClient(client)
 try:
-    out = universe.LookupSpace(eolymp.universe.LookupSpaceInput(key=args.space_key))
-    space = out.space
+    space = common.client.lookup_space(universe, args.space_key)
     print("Found space \"{}\"".format(space.name))
 except Exception as e:
     print("An error occurred while loading space with key \"{}\": {}".format(args.space_key, e))
@@ -39,63 +178,353 @@ judge = eolymp.judge.JudgeClient(client, space.url)
 
 # lookup contest
 try:
-    out = judge.DescribeContest(eolymp.judge.DescribeContestInput(contest_id=args.contest_id))
-    contest = out.contest
+    contest = common.client.describe_contest(judge, args.contest_id)
     print("Found contest \"{}\"".format(contest.name))
 except Exception as e:
     print("An error occurred while loading contest with ID \"{}\": {}".format(args.contest_id, e))
     sys.exit(-1)
 
-# rejudge
+# rejudge, values of the same filter are combined with OR, different filters are combined with AND
 filters = {}
 if args.p:
-    exp = eolymp.wellknown.ExpressionID(value=args.p)
-    setattr(exp, "is", eolymp.wellknown.ExpressionID.EQUAL)
-    filters['problem_id'] = [exp]
+    filters['problem_id'] = []
+    for value in args.p:
+        exp = eolymp.wellknown.ExpressionID(value=value)
+        setattr(exp, "is", eolymp.wellknown.ExpressionID.EQUAL)
+        filters['problem_id'].append(exp)
 
 if args.s:
-    exp = eolymp.wellknown.ExpressionEnum(value=args.s)
-    setattr(exp, "is", eolymp.wellknown.ExpressionEnum.EQUAL)
-    filters['status'] = [exp]
+    filters['status'] = []
+    for value in args.s:
+        exp = eolymp.wellknown.ExpressionEnum(value=value)
+        setattr(exp, "is", eolymp.wellknown.ExpressionEnum.EQUAL)
+        filters['status'].append(exp)
 
 if args.u:
-    exp = eolymp.wellknown.ExpressionID(value=args.u)
-    setattr(exp, "is", eolymp.wellknown.ExpressionID.EQUAL)
-    filters['participant_id'] = [exp]
+    filters['participant_id'] = []
+    for value in args.u:
+        exp = eolymp.wellknown.ExpressionID(value=value)
+        setattr(exp, "is", eolymp.wellknown.ExpressionID.EQUAL)
+        filters['participant_id'].append(exp)
 
-count = 0
-offset = 0
-size = 25
+if args.after is not None:
+    exp = eolymp.wellknown.ExpressionTimestamp(value=timestamp_pb2.Timestamp(seconds=args.after))
+    setattr(exp, "is", eolymp.wellknown.ExpressionTimestamp.GREATER_THAN_EQUAL)
+    filters.setdefault('submitted_at', []).append(exp)
+
+if args.before is not None:
+    exp = eolymp.wellknown.ExpressionTimestamp(value=timestamp_pb2.Timestamp(seconds=args.before))
+    setattr(exp, "is", eolymp.wellknown.ExpressionTimestamp.LESS_THAN)
+    filters.setdefault('submitted_at', []).append(exp)
 
-while True:
-    out = judge.ListSubmissions(eolymp.judge.ListSubmissionsInput(
+
+def list_submissions_input(query, offset, size):
+    return eolymp.judge.ListSubmissionsInput(
         size=size,
         offset=offset,
         contest_id=args.contest_id,
-        filters=eolymp.judge.ListSubmissionsInput.Filter(**filters)
-    ))
+        filters=eolymp.judge.ListSubmissionsInput.Filter(**query)
+    )
 
-    count += len(out.items)
 
-    for item in out.items:
-        print(
-            "  Rejudging submission #{}: problem {}, participant {}, status {}, score: {}".
-            format(item.id, item.problem_id, item.participant_id, item.status, item.score)
-        )
+# asyncio mode: pages are requested from the event loop and collected into a list
+async def list_submissions_async(query):
+    async with async_client:
+        judge_async = eolymp.judge.JudgeClient(async_client, space.url)
 
-        try:
-            judge.RetestSubmission(eolymp.judge.RetestSubmissionInput(contest_id=contest.id, submission_id=item.id))
+        def fetch(offset, size):
+            return judge_async.ListSubmissions(list_submissions_input(query, offset, size))
 
-            # waiting a little not to overwhelm system with too many submissions
-            time.sleep(1)
+        return [items async for items in common.aio.paginate(fetch, args.page_size, args.prefetch)]
 
-        except Exception as e:
-            print("  ERROR: Rejudge failed {}".format(e))
 
-    offset += size
+def list_submissions(query):
+    if async_client:
+        return common.aio.run(list_submissions_async(query))
+
+    def fetch(offset, size):
+        return judge.ListSubmissions(list_submissions_input(query, offset, size))
+
+    return common.client.paginate(fetch, args.page_size, args.prefetch)
+
+
+# IDs of the latest submission of each participant for each problem, from (participant, problem, time, ID) tuples
+def latest_ids(submissions):
+    latest = {}
+    for participant_id, problem_id, submitted_at, submission_id in submissions:
+        key = (participant_id, problem_id)
+        if key not in latest or latest[key][0] < submitted_at:
+            latest[key] = (submitted_at, submission_id)
+
+    return set(submission_id for _, submission_id in latest.values())
+
+
+# take a snapshot of matching submissions before rejudging, rejudge changes submission status, so paging through the
+# listing while submissions are being rejudged would skip some of them
+plan_path = args.plan or "rejudge-{}.json".format(args.contest_id)
+journal_path = plan_path + ".journal"
+options = {
+    'contest_id': args.contest_id,
+    'p': sorted(args.p),
+    'u': sorted(args.u),
+    's': sorted(args.s),
+    'after': args.after,
+    'before': args.before,
+    'latest': args.latest,
+}
+
+plan = load_plan(plan_path)
+if plan and plan['options'] != options:
+    print("Plan \"{}\" was created with different arguments, remove it to start a new rejudge".format(plan_path))
+    sys.exit(-1)
+
+if plan:
+    print("Resuming rejudge plan \"{}\" with {} submissions".format(plan_path, len(plan['submissions'])))
+else:
+    print("Listing submissions...")
+
+    plan = {'options': options, 'submissions': []}
+    seen = set()
+
+    for items in list_submissions(filters):
+        for item in items:
+            # the listing may shift while it's being read, so the same submission may appear twice
+            if item.id in seen:
+                continue
+
+            seen.add(item.id)
+            plan['submissions'].append({
+                'id': item.id,
+                'problem_id': item.problem_id,
+                'participant_id': item.participant_id,
+                'submitted_at': item.submitted_at.seconds,
+                'status': item.status,
+                'verdict': item.verdict,
+                'score': item.score,
+            })
+
+    # only the latest submission of a participant for a problem affects the standings, with status or time filters
+    # the latest submission is looked up among all submissions of the selected problems and participants, so an older
+    # attempt which matches the filters is not selected
+    if args.latest:
+        if args.s or args.after is not None or args.before is not None:
+            print("Looking up latest submissions...")
+
+            query = {key: value for key, value in filters.items() if key in ('problem_id', 'participant_id')}
+            latest = latest_ids((item.participant_id, item.problem_id, item.submitted_at.seconds, item.id)
+                                for items in list_submissions(query) for item in items)
+        else:
+            latest = latest_ids((item['participant_id'], item['problem_id'], item['submitted_at'], item['id'])
+                                for item in plan['submissions'])
 
-    if out.total < offset:
-        break
+        selected = [item for item in plan['submissions'] if item['id'] in latest]
+        print("Selected {} latest submissions out of {}".format(len(selected), len(plan['submissions'])))
+        plan['submissions'] = selected
 
+    save_plan(plan_path, plan)
+    print("Rejudge plan with {} submissions has been saved to \"{}\"".format(len(plan['submissions']), plan_path))
+
+# dispatch rejudge, retested submissions are recorded in the journal, so an interrupted rejudge can be resumed
+done = load_journal(journal_path)
+journal = open(journal_path, 'a', encoding='UTF8')
+
+count = 0
+failed = 0
+
+
+def rejudging(item):
+    print(
+        "  Rejudging submission #{}: problem {}, participant {}, status {}, score: {}".
+        format(item['id'], item['problem_id'], item['participant_id'], item['status'], item['score'])
+    )
+
+
+def retested(item):
+    global count
+
+    journal.write(item['id'] + "\n")
+    journal.flush()
+    done.add(item['id'])
+    count += 1
+
+
+def retest_failed(e):
+    global failed
+
+    print("  ERROR: Rejudge failed {}".format(e))
+    failed += 1
+
+
+async def retest_async(judge_async, item):
+    rejudging(item)
+
+    try:
+        await judge_async.RetestSubmission(eolymp.judge.RetestSubmissionInput(contest_id=contest.id, submission_id=item['id']))
+    except Exception as e:
+        retest_failed(e)
+        return False
+
+    retested(item)
+    return True
+
+
+# asyncio mode: the judge queue is polled every `interval` seconds and the whole difference to the target is
+# dispatched at once instead of one request after another, failed requests delay the next poll with exponential backoff
+async def rejudge_async(submissions):
+    async with async_client:
+        judge_async = eolymp.judge.JudgeClient(async_client, space.url)
+        backoff = 0
+
+        while submissions:
+            polled = time.monotonic()
+
+            try:
+                queued = (await judge_async.ListSubmissions(judge_queue_input(contest.id))).total
+            except Exception as e:
+                print("  ERROR: Unable to read judge queue: {}".format(e))
+                backoff = min(max(1, backoff * 2), 60)
+                await asyncio.sleep(backoff)
+                continue
+
+            budget = max(0, args.target - queued)
+            print("  Judge queue: {} submissions, dispatching {} more".format(queued, budget))
+
+            batch, submissions = submissions[:budget], submissions[budget:]
+            results = await asyncio.gather(*[retest_async(judge_async, item) for item in batch])
+
+            backoff = min(max(1, backoff * 2), 60) if not all(results) else 0
+            if submissions:
+                await asyncio.sleep(max(backoff, args.interval - (time.monotonic() - polled)))
+
+
+if async_client:
+    try:
+        common.aio.run(rejudge_async([item for item in plan['submissions'] if item['id'] not in done]))
+    except KeyboardInterrupt:
+        journal.close()
+        print("Interrupted, rejudged submissions are saved to \"{}\", run the script again to continue".format(journal_path))
+        sys.exit(-1)
+else:
+    throttle = Throttle(judge, contest.id, args.target, args.interval)
+
+    for item in plan['submissions']:
+        if item['id'] in done:
+            continue
+
+        rejudging(item)
+
+        # waiting for the judge to catch up not to overwhelm system with too many submissions
+        throttle.acquire()
+
+        try:
+            judge.RetestSubmission(eolymp.judge.RetestSubmissionInput(contest_id=contest.id, submission_id=item['id']))
+            throttle.success()
+            retested(item)
+        except Exception as e:
+            retest_failed(e)
+            throttle.failure()
+
+journal.close()
 
 print("Rejudge on {} submissions has been started".format(count))
+
+if failed:
+    print("Rejudge failed for {} submissions, run the script again to retry them".format(failed))
+    sys.exit(-1)
+
+
+# poll rejudged submissions in batches until none of them is PENDING or TESTING
+def wait(submissions):
+    remaining = [item['id'] for item in submissions]
+    results = {}
+    started = time.monotonic()
+
+    while remaining:
+        time.sleep(args.interval)
+
+        pending = []
+        for i in range(0, len(remaining), args.page_size):
+            ids = []
+            for sid in remaining[i:i + args.page_size]:
+                exp = eolymp.wellknown.ExpressionID(value=sid)
+                setattr(exp, "is", eolymp.wellknown.ExpressionID.EQUAL)
+                ids.append(exp)
+
+            try:
+                out = judge.ListSubmissions(eolymp.judge.ListSubmissionsInput(
+                    size=len(ids),
+                    contest_id=args.contest_id,
+                    filters=eolymp.judge.ListSubmissionsInput.Filter(id=ids)
+                ))
+            except Exception as e:
+                print("  ERROR: Unable to read submissions: {}".format(e))
+                pending += remaining[i:i + args.page_size]
+                continue
+
+            found = set()
+            for item in out.items:
+                found.add(item.id)
+                if item.status in (eolymp.atlas.Submission.PENDING, eolymp.atlas.Submission.TESTING):
+                    pending.append(item.id)
+                else:
+                    results[item.id] = item
+
+            # submissions which disappeared from the contest are not tracked anymore
+            for sid in remaining[i:i + args.page_size]:
+                if sid not in found and sid not in pending:
+                    results[sid] = None
+
+        remaining = pending
+
+        elapsed = time.monotonic() - started
+        completed = len(submissions) - len(remaining)
+        rate = completed / elapsed * 60
+
+        print("  Completed {} of {}, remaining {}, {:.1f} retests per minute, ETA {}".format(
+            completed, len(submissions), len(remaining), rate,
+            duration(len(remaining) / rate * 60) if rate else "unknown"))
+
+    return results
+
+
+rejudged = [item for item in plan['submissions'] if item['id'] in done]
+
+if args.wait and rejudged:
+    print("Waiting for rejudge to finish...")
+    results = wait(rejudged)
+
+    # summary of verdict changes
+    transitions = {}
+    changes = []
+    for item in rejudged:
+        result = results.get(item['id'])
+        if not result:
+            continue
+
+        before = common.submission.verdict_label(item['status'], item['verdict'])
+        after = common.submission.verdict_label(result.status, result.verdict)
+
+        transitions[(before, after)] = transitions.get((before, after), 0) + 1
+        if before != after or item['score'] != result.score:
+            changes.append((item, before, after, result.score))
+
+    print()
+    print("{:<10} {:<10} {:>8}".format("BEFORE", "AFTER", "COUNT"))
+    for (before, after), number in sorted(transitions.items(), key=lambda t: -t[1]):
+        print("{:<10} {:<10} {:>8}".format(before, after, number))
+
+    if changes:
+        print()
+        print("{} submissions changed verdict or score:".format(len(changes)))
+        print("{:<28} {:<28} {:<28} {:>16} {:>16}".format("SUBMISSION", "PROBLEM", "PARTICIPANT", "BEFORE", "AFTER"))
+        for item, before, after, score in changes:
+            print("{:<28} {:<28} {:<28} {:>16} {:>16}".format(
+                item['id'], item['problem_id'], item['participant_id'],
+                "{} {:g}".format(before, item['score']), "{} {:g}".format(after, score)))
+    else:
+        print()
+        print("No submissions changed verdict or score")
+
+# the plan is complete, the next run takes a new snapshot
+os.remove(journal_path)
+os.remove(plan_path)